@@ -0,0 +1,92 @@
+"""Compares the transaction log lookups with and without the coverage cache.
+
+Fills the transaction log of a SQLite database for a number of sources
+over a number of days, then times the per-source queries the engine
+used to run against a single Database.get_coverage() call, for the last
+day - like a nightly run - and for the whole range.
+"""
+import argparse
+import datetime
+import os
+import shutil
+import tempfile
+import time
+
+from monolith.aggregator.db import Database
+from monolith.aggregator.plugins import Plugin
+from monolith.aggregator.util import date_range
+
+
+def _timed(func, *args):
+    start = time.time()
+    result = func(*args)
+    return time.time() - start, result
+
+
+def run(sources=50, days=3 * 365):
+    """Returns a dict of timings, in seconds."""
+    end = datetime.date.today()
+    start = end - datetime.timedelta(days=days - 1)
+    plugins = [Plugin(id='source-%d' % index) for index in range(sources)]
+    timings = {}
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        def _database(name):
+            path = os.path.join(temp_dir, name)
+            return Database(database='sqlite:///%s' % path)
+
+        # logging the entries, one ORM object per source and per day
+        database = _database('orm.db')
+        timings['add_entry'], _ = _timed(database.add_entry, plugins,
+                                         start, end)
+
+        # vs. a bulk insert
+        database = _database('bulk.db')
+        entries = [(plugin.get_id(), day) for day in date_range(start, end)
+                   for plugin in plugins]
+        timings['add_entries'], _ = _timed(database.add_entries, entries)
+
+        def _exists(start):
+            return [database.exists(plugin, start, end) for plugin in plugins]
+
+        def _get_dates(start):
+            return [database.get_dates(plugin, start, end)
+                    for plugin in plugins]
+
+        def _coverage(start):
+            coverage = database.get_coverage(plugins, start, end)
+            return [coverage[plugin.get_id()].missing(start, end)
+                    for plugin in plugins]
+
+        for name, lookup in (('exists', _exists), ('get_dates', _get_dates),
+                             ('get_coverage', _coverage)):
+            timings[name], _ = _timed(lookup, start)
+            timings['nightly_' + name], _ = _timed(lookup, end)
+    finally:
+        shutil.rmtree(temp_dir)
+
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--sources', default=50, type=int,
+                        help='Number of sources.')
+    parser.add_argument('--days', default=3 * 365, type=int,
+                        help='Number of days.')
+    args = parser.parse_args()
+
+    timings = run(args.sources, args.days)
+    print('%d sources over %d days' % (args.sources, args.days))
+    print('logging:  add_entry %(add_entry).3fs, '
+          'add_entries %(add_entries).3fs' % timings)
+    print('nightly:  exists %(nightly_exists).3fs, '
+          'get_dates %(nightly_get_dates).3fs, '
+          'get_coverage %(nightly_get_coverage).3fs' % timings)
+    print('range:    exists %(exists).3fs, get_dates %(get_dates).3fs, '
+          'get_coverage %(get_coverage).3fs' % timings)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""Measures the CPU burnt by the engine while its sources are slow.
+
+The source sleeps between each page of lines, like a rate-limited Google
+Analytics reader would. Ideally the engine does not use any CPU while
+waiting.
+"""
+import argparse
+import datetime
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+import gevent
+
+from monolith.aggregator.db import Database
+from monolith.aggregator.engine import Engine
+from monolith.aggregator.plugins import Plugin
+
+
+class SlowSource(Plugin):
+
+    def extract(self, start_date, end_date):
+        for page in range(self.options['pages']):
+            gevent.sleep(self.options['delay'])
+            for i in range(self.options['page_size']):
+                yield {'_type': 'idle', '_date': start_date, 'value': i}
+
+
+class NullTarget(Plugin):
+
+    def inject(self, batch):
+        pass
+
+
+def _cpu_time():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run(pages=10, page_size=100, delay=0.2, batch_size=100):
+    """Runs a phase with a slow source and returns a dict of timings."""
+    temp_dir = tempfile.mkdtemp()
+    try:
+        database = Database(database='sqlite:///%s' %
+                            os.path.join(temp_dir, 'monolith.db'))
+        source = SlowSource(id='source:slow', pages=pages,
+                            page_size=page_size, delay=delay)
+        target = NullTarget(id='target:null')
+        engine = Engine([('idle', [source], [target])], database,
+                        batch_size=batch_size)
+        today = datetime.date.today()
+
+        start_cpu, start = _cpu_time(), time.time()
+        engine.run(today, today)
+        cpu, wall = _cpu_time() - start_cpu, time.time() - start
+    finally:
+        shutil.rmtree(temp_dir)
+
+    return {'wall': wall, 'cpu': cpu, 'cpu_percent': cpu / wall * 100}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--pages', default=10, type=int,
+                        help='Number of pages produced by the source.')
+    parser.add_argument('--page-size', default=100, type=int,
+                        help='Number of lines per page.')
+    parser.add_argument('--delay', default=0.2, type=float,
+                        help='Seconds the source waits between pages.')
+    parser.add_argument('--batch-size', default=100, type=int,
+                        help='The size of the batch when writing')
+    args = parser.parse_args()
+
+    res = run(args.pages, args.page_size, args.delay, args.batch_size)
+    print('wall: %(wall).2fs  cpu: %(cpu).2fs  idle cpu: '
+          '%(cpu_percent).1f%%' % res)
+
+
+if __name__ == '__main__':
+    main()
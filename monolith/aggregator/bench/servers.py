@@ -0,0 +1,334 @@
+"""Stand-in servers for the remote sources, to benchmark them offline.
+
+A single gevent WSGI server answers like:
+
+- the Google Analytics v3 API, data.ga.get, paginated with nextLink,
+  with its discovery document
+- a Tastypie API like zamboni's, paginated with meta.next
+- the solitude transaction endpoint
+- an S3 bucket holding the solitude revenue logs
+
+The data is generated and deterministic. Every response can be delayed,
+fail with a 500 at a given rate, or be throttled past a number of
+requests per second per service. /_stats returns the number of requests,
+errors and throttled requests of each service.
+"""
+import argparse
+from collections import defaultdict, deque
+import csv
+import datetime
+from email.utils import formatdate
+import hashlib
+import random
+from StringIO import StringIO
+import socket
+import subprocess
+import sys
+import time
+from urlparse import parse_qsl
+import urllib2
+
+import gevent
+from gevent.pywsgi import WSGIServer
+
+from monolith.aggregator.util import json_dumps
+
+
+GA_PATH = '/analytics/v3/'
+DISCOVERY_PATH = '/discovery/v1/apis/{api}/{apiVersion}/rest'
+TASTYPIE_PATH = '/api/v1/stats/'
+TRANSACTION_PATH = '/transaction/'
+BUCKET = 'revenue'
+
+
+def _parameter(type_='string', required=False):
+    return {'type': type_, 'location': 'query', 'required': required}
+
+
+def _discovery(root_url):
+    # the little of the analytics discovery document apiclient needs
+    parameters = {'ids': _parameter(required=True),
+                  'start-date': _parameter(required=True),
+                  'end-date': _parameter(required=True),
+                  'metrics': _parameter(required=True),
+                  'dimensions': _parameter(),
+                  'filters': _parameter(),
+                  'start-index': _parameter('integer'),
+                  'max-results': _parameter('integer')}
+    get = {'id': 'analytics.data.ga.get', 'path': 'data/ga',
+           'httpMethod': 'GET', 'parameters': parameters,
+           'parameterOrder': ['ids', 'start-date', 'end-date', 'metrics'],
+           'response': {'$ref': 'GaData'}}
+    return {'kind': 'discovery#restDescription', 'discoveryVersion': 'v1',
+            'id': 'analytics:v3', 'name': 'analytics', 'version': 'v3',
+            'protocol': 'rest', 'rootUrl': root_url,
+            'servicePath': GA_PATH[1:],
+            'schemas': {'GaData': {'id': 'GaData', 'type': 'object'}},
+            'resources': {'data': {'resources': {
+                'ga': {'methods': {'get': get}}}}}}
+
+
+def _date(value):
+    return datetime.datetime.strptime(value[:10], '%Y-%m-%d').date()
+
+
+def _days(start, end):
+    return [start + datetime.timedelta(days=n)
+            for n in range((end - start).days + 1)]
+
+
+class FakeServers(object):
+    """The WSGI application of the stand-in servers.
+
+    *latency* is the delay of every response in seconds, *error_rate*
+    the share of requests failing with a 500 and *rate_limit* the number
+    of requests per second each service accepts before throttling.
+    The other options set the amount of data generated per day.
+    """
+    def __init__(self, latency=0, error_rate=0, rate_limit=None, seed=0,
+                 ga_rows=2500, api_records=1000, revenue_rows=20):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.seed = seed
+        self.ga_rows = ga_rows
+        self.api_records = api_records
+        self.revenue_rows = revenue_rows
+        self.stats = defaultdict(lambda: defaultdict(int))
+        self._calls = defaultdict(deque)
+        self._random = random.Random(seed)
+
+    def _throttled(self, service):
+        if self.rate_limit is None:
+            return False
+        now = time.time()
+        calls = self._calls[service]
+        while calls and calls[0] <= now - 1:
+            calls.popleft()
+        if len(calls) >= self.rate_limit:
+            return True
+        calls.append(now)
+        return False
+
+    def __call__(self, environ, start_response):
+        path = environ['PATH_INFO']
+        params = dict(parse_qsl(environ.get('QUERY_STRING', '')))
+        environ['params'] = params
+
+        if path == '/_stats':
+            return self._respond(start_response, '200 OK', self.stats)
+        if path.startswith('/discovery/'):
+            root_url = 'http://%s/' % environ['HTTP_HOST']
+            return self._respond(start_response, '200 OK',
+                                 _discovery(root_url))
+
+        for prefix, service in ((GA_PATH, 'ga'), (TASTYPIE_PATH, 'tastypie'),
+                                (TRANSACTION_PATH, 'solitude'),
+                                ('/%s/' % BUCKET, 's3')):
+            if path.startswith(prefix):
+                break
+        else:
+            return self._respond(start_response, '404 Not Found',
+                                 {'reason': 'Not Found'})
+
+        stats = self.stats[service]
+        stats['requests'] += 1
+        if self.latency:
+            gevent.sleep(self.latency)
+
+        if self._throttled(service):
+            stats['throttled'] += 1
+            if service == 'ga':
+                error = {'error': {'code': 403, 'message': 'Rate limited',
+                                   'errors': [{'reason':
+                                               'userRateLimitExceeded'}]}}
+                return self._respond(start_response, '403 Forbidden', error)
+            return self._respond(start_response, '429 Too Many Requests',
+                                 {'reason': 'Too Many Requests'})
+
+        if self.error_rate and self._random.random() < self.error_rate:
+            stats['errors'] += 1
+            return self._respond(start_response,
+                                 '500 Internal Server Error',
+                                 {'reason': 'Boom'})
+
+        return getattr(self, '_' + service)(environ, start_response)
+
+    def _respond(self, start_response, status, body,
+                 content_type='application/json', headers=()):
+        if content_type == 'application/json':
+            body = json_dumps(body)
+        start_response(status, [('Content-Type', content_type),
+                                ('Content-Length', str(len(body)))] +
+                       list(headers))
+        return [body]
+
+    #
+    # Google Analytics
+    #
+    def _ga(self, environ, start_response):
+        params = environ['params']
+        day = _date(params['start-date'])
+        dimensions = params.get('dimensions', 'ga:date').split(',')
+        metrics = params['metrics'].split(',')
+        start = int(params.get('start-index', 1))
+        count = int(params.get('max-results', 1000))
+
+        rows = []
+        for index in range(start - 1, min(start - 1 + count, self.ga_rows)):
+            row = []
+            for dimension in dimensions:
+                if dimension == 'ga:date':
+                    row.append(day.strftime('%Y%m%d'))
+                else:
+                    row.append('%s-%d' % (dimension[3:], index))
+            row.extend(str((index * 7 + day.toordinal()) % 1000 + 1)
+                       for metric in metrics)
+            rows.append(row)
+
+        result = {'totalResults': self.ga_rows,
+                  'columnHeaders': [{'name': name}
+                                    for name in dimensions + metrics],
+                  'rows': rows}
+        if start - 1 + count < self.ga_rows:
+            result['nextLink'] = 'http://%s%sdata/ga?start-index=%d' % (
+                environ['HTTP_HOST'], GA_PATH, start + count)
+        return self._respond(start_response, '200 OK', result)
+
+    #
+    # Tastypie API
+    #
+    def _tastypie(self, environ, start_response):
+        params = environ['params']
+        days = _days(_date(params['start']), _date(params['end']))
+        # like zamboni, the end date is excluded
+        total = self.api_records * (len(days) - 1)
+        offset = int(params.get('offset', 0))
+        limit = int(params.get('limit', 20))
+
+        objects = []
+        for index in range(offset, min(offset + limit, total)):
+            day = days[index // self.api_records]
+            objects.append({'recorded': '%sT12:00:00' % day.isoformat(),
+                            'value': {'user-agent': 'ua-%d' % (index % 10),
+                                      'app-id': index % 100,
+                                      'count': index % 7 + 1}})
+
+        next_ = None
+        if offset + limit < total:
+            next_ = '%s?offset=%d&limit=%d' % (TASTYPIE_PATH,
+                                               offset + limit, limit)
+        return self._respond(start_response, '200 OK',
+                             {'meta': {'next': next_, 'total_count': total,
+                                       'offset': offset, 'limit': limit},
+                              'objects': objects})
+
+    #
+    # solitude
+    #
+    def _solitude(self, environ, start_response):
+        uuid = environ['PATH_INFO'][len(TRANSACTION_PATH):].strip('/')
+        app_id = int(hashlib.md5(uuid).hexdigest()[:4], 16) % 100
+        return self._respond(start_response, '200 OK',
+                             {'uuid': uuid, 'app_id': app_id,
+                              'amount_USD': '0.99'})
+
+    def _revenue_log(self, day):
+        output = StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['date', 'uuid', 'created', 'modified', 'amount',
+                         'currency', 'status', 'type', 'provider', 'source'])
+        for index in range(self.revenue_rows):
+            writer.writerow([day.isoformat(), 'tx-%s-%d' % (day, index), '',
+                             '', '0.99', 'USD', '1', '0', '1',
+                             'marketplace'])
+        return output.getvalue()
+
+    def _s3(self, environ, start_response):
+        key = environ['PATH_INFO'][len(BUCKET) + 2:]
+        if key == '':
+            # the bucket itself
+            body = ('<?xml version="1.0" encoding="UTF-8"?>'
+                    '<ListBucketResult><Name>%s</Name>'
+                    '<IsTruncated>false</IsTruncated>'
+                    '</ListBucketResult>' % BUCKET)
+            return self._respond(start_response, '200 OK', body,
+                                 'application/xml')
+
+        try:
+            day = datetime.datetime.strptime(
+                key, '%Y-%m-%d.revenue.log').date()
+        except ValueError:
+            body = '<Error><Code>NoSuchKey</Code></Error>'
+            return self._respond(start_response, '404 Not Found', body,
+                                 'application/xml')
+
+        body = self._revenue_log(day)
+        headers = [('ETag', '"%s"' % hashlib.md5(body).hexdigest()),
+                   ('Last-Modified', formatdate(usegmt=True))]
+        response = self._respond(start_response, '200 OK', body,
+                                 'text/plain', headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return ['']
+        return response
+
+
+def serve(port, **options):
+    server = WSGIServer(('127.0.0.1', port), FakeServers(**options),
+                        log=None)
+    server.serve_forever()
+
+
+def free_port():
+    sock = socket.socket()
+    try:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+    finally:
+        sock.close()
+
+
+def start(latency=0, error_rate=0, rate_limit=None, timeout=10):
+    """Starts the servers in a new process.
+
+    Returns the process and the root URL of the servers, once they
+    answer.
+    """
+    port = free_port()
+    args = [sys.executable, '-m', 'monolith.aggregator.bench.servers',
+            '--port', str(port), '--latency', str(latency),
+            '--error-rate', str(error_rate)]
+    if rate_limit is not None:
+        args.extend(['--rate-limit', str(rate_limit)])
+    process = subprocess.Popen(args)
+
+    url = 'http://127.0.0.1:%d' % port
+    deadline = time.time() + timeout
+    while True:
+        try:
+            urllib2.urlopen(url + '/_stats').read()
+            return process, url
+        except urllib2.URLError:
+            if time.time() > deadline or process.poll() is not None:
+                process.kill()
+                raise
+            time.sleep(0.05)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--port', default=8000, type=int,
+                        help='The port to listen to.')
+    parser.add_argument('--latency', default=0, type=float,
+                        help='The delay of every response, in seconds.')
+    parser.add_argument('--error-rate', default=0, type=float,
+                        help='The share of requests failing with a 500.')
+    parser.add_argument('--rate-limit', default=None, type=int,
+                        help='The requests per second each service accepts.')
+    args = parser.parse_args()
+    serve(args.port, latency=args.latency, error_rate=args.error_rate,
+          rate_limit=args.rate_limit)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,170 @@
+"""Measures the extraction throughput of the remote sources.
+
+Starts the stand-in servers of monolith.aggregator.bench.servers with
+the given latency, error rate and rate limit, then extracts a number of
+Google Analytics, zamboni or solitude sources through the engine, into
+a target discarding the lines.
+
+monolith-extract monkey-patches the standard library, but the engine
+itself does not. Without --monkey-patch, the sources wait for each
+other's requests. --monkey-patch patches it with gevent first, like
+monolith-extract does.
+"""
+import argparse
+import datetime
+import os
+import shutil
+import tempfile
+import time
+import urllib2
+
+from monolith.aggregator.bench import servers
+from monolith.aggregator.db import Database
+from monolith.aggregator.engine import Engine
+from monolith.aggregator.plugins import Plugin
+from monolith.aggregator.stats import Stats
+from monolith.aggregator.util import json_dumps, json_loads
+
+
+KINDS = ('ga', 'zamboni', 'solitude')
+START_DATE = datetime.date(2013, 1, 1)
+
+
+class NullTarget(Plugin):
+
+    def inject(self, batch):
+        pass
+
+
+def _ga(index, url, directory, rate_limit=None):
+    import gflags
+    from monolith.aggregator.plugins.ganalytics import GAPageViews
+
+    # apiclient reads its flags, which recent versions of python-gflags
+    # refuse until they are parsed
+    gflags.FLAGS(['monolith'])
+
+    token = os.path.join(directory, 'auth.json')
+    if not os.path.exists(token):
+        with open(token, 'w') as f:
+            f.write(json_dumps({'access_token': 'XXX', 'client_id': 'XXX',
+                                'client_secret': 'XXX',
+                                'refresh_token': 'XXX', 'token_expiry': None,
+                                'token_uri': url + '/token',
+                                'user_agent': None}))
+    options = {'id': 'source:ga-%d' % index, 'oauth_token': token,
+               'profile_id': '12345678', 'metrics': 'ga:pageviews',
+               'dimensions': 'ga:date,ga:browser',
+               'discovery_url': url + servers.DISCOVERY_PATH}
+    if rate_limit is not None:
+        options['rate_limit'] = rate_limit
+    return GAPageViews(**options)
+
+
+def _zamboni(index, url, directory, rate_limit=None):
+    from monolith.aggregator.plugins.zamboni import APIReader
+
+    return APIReader(id='source:zamboni-%d' % index,
+                     endpoint=url + servers.TASTYPIE_PATH, type='installs',
+                     field='app_installs', dimensions='user-agent, app-id')
+
+
+def _solitude(index, url, directory, rate_limit=None):
+    from monolith.aggregator.plugins.solitude import SolitudeReader
+
+    keys = os.path.join(directory, 'keys.ini')
+    if not os.path.exists(keys):
+        host, port = url[len('http://'):].split(':')
+        with open(keys, 'w') as f:
+            f.write('[auth]\naccess_key = KEY\nsecret_key = SECRET\n'
+                    'bucket = %s\nhost = %s\nport = %s\n' % (servers.BUCKET,
+                                                             host, port))
+    endpoint = url + servers.TRANSACTION_PATH + ':transaction_id/'
+    return SolitudeReader(**{'id': 'source:solitude-%d' % index,
+                             'endpoint': endpoint, 'type': 'revenue',
+                             'keys-file': keys})
+
+
+def run(kind, sources=4, days=3, latency=0.05, error_rate=0,
+        rate_limit=None, client_rate_limit=None, retries=3):
+    """Extracts *sources* sources of a kind from the stand-in servers.
+
+    Returns the results, with the counters of the servers.
+    """
+    process, url = servers.start(latency, error_rate, rate_limit)
+    temp_dir = tempfile.mkdtemp()
+    try:
+        factory = globals()['_' + kind]
+        plugins = [factory(index, url, temp_dir, client_rate_limit)
+                   for index in range(sources)]
+        database = Database(database='sqlite:///%s' %
+                            os.path.join(temp_dir, 'monolith.db'))
+        stats = Stats()
+        engine = Engine([('extract', plugins, [NullTarget(id='null')])],
+                        database, retries=retries, stats=stats)
+
+        start = time.time()
+        try:
+            engine.run(START_DATE,
+                       START_DATE + datetime.timedelta(days=days - 1))
+            status = 'success'
+        except Exception:
+            status = 'failure'
+        wall = time.time() - start
+
+        server_stats = json_loads(urllib2.urlopen(url + '/_stats').read())
+    finally:
+        process.kill()
+        process.wait()
+        shutil.rmtree(temp_dir)
+
+    report = stats.report()
+    phase = report['phases'].get('extract', {})
+    records = report['targets'].get('null', {}).get('records', 0)
+    return {'kind': kind, 'sources': sources, 'days': days,
+            'status': status, 'wall': wall, 'records': records,
+            'records_per_sec': records / wall,
+            'runs': phase.get('runs', 0), 'retries': phase.get('retries', 0),
+            'servers': server_stats}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--kind', default=None, choices=KINDS,
+                        help='The kind of sources. Defaults to all.')
+    parser.add_argument('--sources', default=4, type=int,
+                        help='Number of sources extracted at once.')
+    parser.add_argument('--days', default=3, type=int,
+                        help='Number of days extracted.')
+    parser.add_argument('--latency', default=0.05, type=float,
+                        help='The delay of every response, in seconds.')
+    parser.add_argument('--error-rate', default=0, type=float,
+                        help='The share of requests failing with a 500.')
+    parser.add_argument('--rate-limit', default=None, type=int,
+                        help='The requests per second each server accepts.')
+    parser.add_argument('--client-rate-limit', default=None, type=int,
+                        help='The rate_limit option of the GA sources.')
+    parser.add_argument('--retries', default=3, type=int,
+                        help='Number of retries')
+    parser.add_argument('--monkey-patch', action='store_true',
+                        default=False,
+                        help='Monkey-patches the standard library.')
+    args = parser.parse_args()
+
+    if args.monkey_patch:
+        from gevent import monkey
+        monkey.patch_all()
+
+    for kind in args.kind and [args.kind] or KINDS:
+        res = run(kind, args.sources, args.days, args.latency,
+                  args.error_rate, args.rate_limit, args.client_rate_limit,
+                  args.retries)
+        print('%(kind)s: %(status)s, %(records)d records in %(wall).2fs, '
+              '%(records_per_sec).0f records/s, %(retries)d retries' % res)
+        for service, counters in sorted(res['servers'].items()):
+            print('  %s: %s' % (service, ', '.join(
+                '%s %d' % item for item in sorted(counters.items()))))
+
+
+if __name__ == '__main__':
+    main()
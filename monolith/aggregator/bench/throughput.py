@@ -0,0 +1,247 @@
+"""Measures the end-to-end throughput of the engine.
+
+Pushes generated lines through the engine, offline, with SQLite and
+in-memory targets, and reports the records per second, the peak RSS
+and the time spent in each source and target.
+
+The scenarios are:
+
+- random-sql: generated lines loaded in a SQLite database
+- sql-file: lines of a SQLite database written in a JSON lines file
+- random-sql-file: generated lines loaded in SQLite and a file
+- random-multi: generated lines loaded in SQLite, a file and memory
+
+The lines come from the synthetic generator, or from the random
+generator with --generator random.
+
+Each scenario runs in its own process so its peak RSS is its own. The
+results are appended to a JSON lines file, and compared to the previous
+results of the same scenario and volume. That file is in the temporary
+directory unless --results says otherwise.
+"""
+import argparse
+import datetime
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from monolith.aggregator.db import Database
+from monolith.aggregator.engine import Engine
+from monolith.aggregator.plugins import Plugin
+from monolith.aggregator.plugins.files import FileWriter
+from monolith.aggregator.plugins.randomizer import (RandomGenerator,
+                                                    SyntheticGenerator)
+from monolith.aggregator.stats import Stats
+from monolith.aggregator.util import json_dumps, json_loads
+
+
+SCENARIOS = ('random-sql', 'sql-file', 'random-sql-file', 'random-multi')
+GENERATORS = ('synthetic', 'random')
+START_DATE = datetime.date(2013, 1, 1)
+RESULTS = os.path.join(tempfile.gettempdir(), 'monolith-bench-results.json')
+
+
+def _source(generator, addons):
+    if generator == 'random':
+        return RandomGenerator(id='source:rand', addons=addons)
+    return SyntheticGenerator(id='source:rand', records=addons,
+                              dimensions='os:3, add_on:%d' % addons)
+
+
+def _end_date(days):
+    return START_DATE + datetime.timedelta(days=days - 1)
+
+
+class MemoryTarget(Plugin):
+
+    def __init__(self, **options):
+        Plugin.__init__(self, **options)
+        self.lines = []
+
+    def inject(self, batch):
+        self.lines.extend(batch)
+
+
+def _fill(path, generator, addons, days, batch_size):
+    # the source database of the sql-file scenario
+    database = Database(database='sqlite:///%s' % path)
+    source = _source(generator, addons)
+    batch = []
+    for item in source.extract(START_DATE, _end_date(days)):
+        batch.append(('source:rand', item))
+        if len(batch) == batch_size:
+            database.inject(batch)
+            batch = []
+    if batch:
+        database.inject(batch)
+
+
+def _sequence(scenario, directory, generator, addons, days, batch_size):
+    def _sql(id, name):
+        return Database(id=id, database='sqlite:///%s' %
+                        os.path.join(directory, name))
+
+    def _file(id):
+        return FileWriter(id=id, filename=os.path.join(directory,
+                                                       'lines.json'))
+
+    random = _source(generator, addons)
+    if scenario == 'random-sql':
+        return [('load', [random], [_sql('target:sql', 'data.db')])]
+    elif scenario == 'sql-file':
+        _fill(os.path.join(directory, 'data.db'), generator, addons, days,
+              batch_size)
+        return [('dump', [_sql('source:sql', 'data.db')],
+                 [_file('target:file')])]
+    elif scenario == 'random-sql-file':
+        return [('load', [random],
+                 [_sql('target:sql', 'data.db'), _file('target:file')])]
+    elif scenario == 'random-multi':
+        return [('load', [random],
+                 [_sql('target:sql', 'data.db'), _file('target:file'),
+                  MemoryTarget(id='target:memory')])]
+    raise NotImplementedError(scenario)
+
+
+def _peak_rss():
+    # in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def run(scenario, addons=1000, days=10, batch_size=100,
+        generator='synthetic'):
+    """Runs a scenario in this process and returns its results.
+
+    The generator produces *addons* lines per day.
+    """
+    temp_dir = tempfile.mkdtemp()
+    try:
+        sequence = _sequence(scenario, temp_dir, generator, addons, days,
+                             batch_size)
+        database = Database(database='sqlite:///%s' %
+                            os.path.join(temp_dir, 'monolith.db'))
+        stats = Stats()
+        engine = Engine(sequence, database, batch_size=batch_size,
+                        stats=stats)
+
+        start = time.time()
+        engine.run(START_DATE, _end_date(days))
+        wall = time.time() - start
+    finally:
+        shutil.rmtree(temp_dir)
+
+    report = stats.report()
+    records = sum(counters.get('records', 0)
+                  for counters in report['sources'].values())
+    stages = {}
+    for kind, prefix in (('sources', 'extract'), ('targets', 'inject')):
+        for name, counters in report[kind].items():
+            stages['%s %s' % (prefix, name)] = counters.get('time', 0)
+            if 'commit_time' in counters:
+                stages['commit %s' % name] = counters['commit_time']
+
+    return {'scenario': scenario, 'generator': generator, 'addons': addons,
+            'days': days, 'batch_size': batch_size, 'records': records,
+            'wall': wall, 'records_per_sec': records / wall,
+            'peak_rss': _peak_rss(), 'stages': stages}
+
+
+def _run_process(scenario, addons, days, batch_size, generator):
+    process = subprocess.Popen([
+        sys.executable, '-m', 'monolith.aggregator.bench.throughput',
+        '--scenario', scenario, '--addons', str(addons), '--days', str(days),
+        '--batch-size', str(batch_size), '--generator', generator,
+        '--json'], stdout=subprocess.PIPE)
+    output = process.communicate()[0]
+    if process.returncode != 0:
+        raise RuntimeError('The %s scenario failed' % scenario)
+    return json_loads(output.splitlines()[-1])
+
+
+def _commit():
+    try:
+        with open(os.devnull, 'w') as devnull:
+            process = subprocess.Popen(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                stdout=subprocess.PIPE, stderr=devnull)
+            output = process.communicate()[0]
+    except OSError:
+        return None
+    if process.returncode != 0:
+        return None
+    return output.strip()
+
+
+def _previous(path, result):
+    """Returns the last stored result of the same scenario and volume."""
+    if not os.path.exists(path):
+        return None
+    keys = ('scenario', 'generator', 'addons', 'days', 'batch_size')
+    previous = None
+    with open(path) as f:
+        for line in f:
+            stored = json_loads(line)
+            if all(stored.get(key) == result[key] for key in keys):
+                previous = stored
+    return previous
+
+
+def _print(result, previous):
+    print('%(scenario)s: %(records)d records in %(wall).2fs, '
+          '%(records_per_sec).0f records/s, peak RSS %(peak_rss)d KB'
+          % result)
+    if previous is not None:
+        change = ((result['records_per_sec'] - previous['records_per_sec'])
+                  * 100. / previous['records_per_sec'])
+        print('  %+.1f%% records/s since %s (%s)' % (
+            change, previous.get('commit') or 'unknown commit',
+            previous['date']))
+    for stage, seconds in sorted(result['stages'].items()):
+        print('  %-30s %8.3fs' % (stage, seconds))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--scenario', default=None, choices=SCENARIOS,
+                        help='The scenario to run. Defaults to all.')
+    parser.add_argument('--addons', default=1000, type=int,
+                        help='Number of lines generated per day.')
+    parser.add_argument('--days', default=10, type=int,
+                        help='Number of days generated.')
+    parser.add_argument('--batch-size', default=100, type=int,
+                        help='The size of the batch when writing')
+    parser.add_argument('--generator', default='synthetic',
+                        choices=GENERATORS,
+                        help='The source of the lines.')
+    parser.add_argument('--results', default=RESULTS,
+                        help='The file where the results are appended.')
+    parser.add_argument('--no-save', action='store_true', default=False,
+                        help='Does not store the results.')
+    parser.add_argument('--json', action='store_true', default=False,
+                        help='Runs a single scenario in this process and '
+                             'prints its results in JSON.')
+    args = parser.parse_args()
+
+    if args.json:
+        print(json_dumps(run(args.scenario or SCENARIOS[0], args.addons,
+                             args.days, args.batch_size, args.generator)))
+        return
+
+    commit = _commit()
+    for scenario in args.scenario and [args.scenario] or SCENARIOS:
+        result = _run_process(scenario, args.addons, args.days,
+                              args.batch_size, args.generator)
+        result['commit'] = commit
+        result['date'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M')
+        _print(result, _previous(args.results, result))
+        if not args.no_save:
+            with open(args.results, 'a') as f:
+                f.write(json_dumps(result) + '\n')
+
+
+if __name__ == '__main__':
+    main()
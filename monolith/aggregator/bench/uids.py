@@ -0,0 +1,60 @@
+"""Compares the ways of generating record ids.
+
+- uid: a urlsafe_uid call per id, like the SQL target used to do
+- uids: a urlsafe_uids call per batch of --batch-size ids
+- natural: a natural_uid call per id, like upserting SQL targets do
+"""
+import argparse
+import datetime
+import time
+
+from monolith.aggregator.uid import natural_uid, urlsafe_uid, urlsafe_uids
+
+
+METHODS = ('uid', 'uids', 'natural')
+DATE = datetime.date(2013, 1, 1)
+
+
+def _uid(ids, batch_size):
+    for __ in xrange(ids):
+        urlsafe_uid(DATE)
+
+
+def _uids(ids, batch_size):
+    for start in xrange(0, ids, batch_size):
+        urlsafe_uids(min(batch_size, ids - start), DATE)
+
+
+def _natural(ids, batch_size):
+    for index in xrange(ids):
+        natural_uid('source:bench', DATE, 'installs', {'app': index})
+
+
+def run(method, ids=1000000, batch_size=1000):
+    """Generates *ids* ids and returns the ids per second."""
+    generate = globals()['_' + method]
+    start = time.time()
+    generate(ids, batch_size)
+    return ids / (time.time() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--ids', default=1000000, type=int,
+                        help='Number of ids generated.')
+    parser.add_argument('--batch-size', default=1000, type=int,
+                        help='Number of ids per urlsafe_uids call.')
+    parser.add_argument('--method', default=None, choices=METHODS,
+                        help='The method to measure. Defaults to all.')
+    args = parser.parse_args()
+
+    rates = {}
+    for method in args.method and [args.method] or METHODS:
+        rates[method] = run(method, args.ids, args.batch_size)
+        print('%s: %.0f ids/s' % (method, rates[method]))
+    if 'uid' in rates and 'uids' in rates:
+        print('  uids is %.1fx uid' % (rates['uids'] / rates['uid']))
+
+
+if __name__ == '__main__':
+    main()
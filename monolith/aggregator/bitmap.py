@@ -0,0 +1,43 @@
+from datetime import timedelta
+
+
+class DateBitmap(object):
+    """A set of dates, stored as the bits of an integer.
+
+    Bit *n* is set when the date *origin + n days* is in the set. This
+    keeps years of daily coverage in a few hundred bytes, and makes
+    lookups simple bit operations.
+    """
+    def __init__(self, origin, dates=()):
+        self.origin = origin
+        self.bits = 0
+        for date in dates:
+            self.add(date)
+
+    def _offset(self, date):
+        offset = (date - self.origin).days
+        if offset < 0:
+            raise ValueError('%s is before %s' % (date, self.origin))
+        return offset
+
+    def add(self, date):
+        self.bits |= 1 << self._offset(date)
+
+    def __contains__(self, date):
+        offset = (date - self.origin).days
+        return offset >= 0 and bool(self.bits >> offset & 1)
+
+    def __len__(self):
+        return bin(self.bits).count('1')
+
+    def missing(self, start_date, end_date):
+        """Returns the dates of a range that are not in the set."""
+        days = (end_date - start_date).days + 1
+        offset = (start_date - self.origin).days
+        if offset >= 0:
+            bits = self.bits >> offset
+        else:
+            bits = self.bits << -offset
+
+        return [start_date + timedelta(days=day) for day in xrange(days)
+                if not bits >> day & 1]
@@ -0,0 +1,91 @@
+from collections import Mapping
+from itertools import izip
+
+
+class Row(Mapping):
+    """A read-only mapping view of a line of a :class:`Columns` batch.
+
+    The values are read from the columns when accessed, so going through
+    the lines of a batch does not build a dict per line.
+    """
+    def __init__(self, batch, index):
+        self._batch = batch
+        self._index = index
+
+    def __getitem__(self, key):
+        batch = self._batch
+        return batch.columns[batch.positions[key]][self._index]
+
+    def __iter__(self):
+        return iter(self._batch.keys)
+
+    def __len__(self):
+        return len(self._batch.keys)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+
+class Columns(object):
+    """A batch of lines stored column by column.
+
+    All the lines share the same *keys*, and *columns* holds a list of
+    values per key, in the same order. The keys are stored once per
+    batch instead of once per line.
+
+    A batch can be used where a list of lines is expected: its length
+    is its number of lines, slicing it returns a new batch and iterating
+    it yields a :class:`Row` per line.
+    """
+    def __init__(self, keys, columns):
+        self.keys = tuple(keys)
+        self.columns = list(columns)
+        if len(self.keys) != len(self.columns):
+            raise ValueError('%d keys for %d columns' % (len(self.keys),
+                                                         len(self.columns)))
+        self.positions = dict((key, position)
+                              for position, key in enumerate(self.keys))
+
+    @classmethod
+    def from_items(cls, items):
+        """Builds a batch from a list of mappings having the same keys."""
+        if len(items) == 0:
+            return cls((), ())
+        keys = list(items[0])
+        return cls(keys, [[item[key] for item in items] for key in keys])
+
+    def __len__(self):
+        if not self.columns:
+            return 0
+        return len(self.columns[0])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return Columns(self.keys, [column[index]
+                                       for column in self.columns])
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return Row(self, index)
+
+    def __iter__(self):
+        for index in xrange(len(self)):
+            yield Row(self, index)
+
+    def __repr__(self):
+        return '<Columns %s, %d lines>' % (', '.join(self.keys), len(self))
+
+    def column(self, key):
+        """Returns the values of a key."""
+        return self.columns[self.positions[key]]
+
+    def rows(self, keys=None):
+        """Returns an iterator of tuples of the values of each line.
+
+        The values follow the order of *keys*, all the keys of the batch
+        by default.
+        """
+        if keys is None:
+            return izip(*self.columns)
+        return izip(*[self.column(key) for key in keys])
@@ -1,16 +1,27 @@
+from collections import defaultdict
 from contextlib import contextmanager
 import datetime
+import inspect
+from itertools import izip
+import re
+import tempfile
 
-from sqlalchemy import Column, Date, Integer, LargeBinary, String
+from sqlalchemy import (Column, Date, DateTime, Float, Integer, LargeBinary,
+                        String)
 from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.sql import text
+from sqlalchemy.sql import and_, select, text
 from sqlalchemy.types import BINARY
 
+from monolith.aggregator import logger
+from monolith.aggregator.bitmap import DateBitmap
+from monolith.aggregator.columns import Columns
+from monolith.aggregator.exception import InjectError
 from monolith.aggregator.plugins import Plugin
-from monolith.aggregator.uid import urlsafe_uid
-from monolith.aggregator.util import date_range, json_dumps, json_loads
+from monolith.aggregator.uid import natural_uid, urlsafe_uids
+from monolith.aggregator.util import (boolean, date_range, json_dumps,
+                                      json_loads)
 
 _Model = declarative_base()
 
@@ -43,36 +54,178 @@ class Transaction(_Model):
     source = Column(String(256), nullable=False)
 
 
+class Run(_Model):
+    __tablename__ = 'monolith_run'
+    __table_args__ = {
+        'mysql_engine': 'InnoDB',
+        'mysql_charset': 'utf8',
+    }
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    started = Column(DateTime, nullable=False)
+    duration = Column(Float)
+    status = Column(String(32), nullable=False)
+    start_date = Column(Date)
+    end_date = Column(Date)
+    # JSON mappings
+    arguments = Column(LargeBinary)
+    report = Column(LargeBinary)
+
+
 record_table = Record.__table__
 transaction_table = Transaction.__table__
+run_table = Run.__table__
 
 
-def get_engine(sqluri, pool_size=100, pool_recycle=60, pool_timeout=30):
+def get_engine(sqluri, pool_size=100, pool_recycle=60, pool_timeout=30,
+               local_infile=False):
     extras = {}
     if not sqluri.startswith('sqlite'):
         extras['pool_size'] = pool_size
         extras['pool_timeout'] = pool_timeout
         extras['pool_recycle'] = pool_recycle
+    if local_infile:
+        # allows LOAD DATA LOCAL INFILE with the MySQL drivers
+        extras['connect_args'] = {'local_infile': 1}
 
     return create_engine(sqluri, **extras)
 
 
+def local_infile_supported(sqluri):
+    """Tells if the driver of a MySQL URI takes the local_infile option.
+
+    PyMySQL only has it since 0.6.2, and older versions fail to connect
+    when it is passed. The other drivers are assumed to support it.
+    """
+    if not sqluri.startswith('mysql+pymysql'):
+        return True
+    from pymysql.connections import Connection
+    return 'local_infile' in inspect.getargspec(Connection.__init__).args
+
+
+# the columns of the record table, in the order of the loaded files
+_LOAD_COLUMNS = ('id', 'date', 'type', 'source_id', 'value')
+
+_LOAD_QUERY = ('LOAD DATA LOCAL INFILE :filename %sINTO TABLE record '
+               'CHARACTER SET utf8 (' + ', '.join(_LOAD_COLUMNS) + ')')
+
+_INSERT_QUERY = ('INSERT INTO record (' + ', '.join(_LOAD_COLUMNS) +
+                 ') VALUES %s')
+
+_UPSERT_SUFFIX = ' ON DUPLICATE KEY UPDATE value = VALUES(value)'
+
+# the rows of a multi-row INSERT, well below the default
+# max_allowed_packet of MySQL
+_INSERT_CHUNK = 1000
+
+
+def _values_query(count, suffix=''):
+    """Returns an INSERT of *count* records in a single statement.
+
+    The parameters of the n-th record are suffixed with _n, as in
+    :func:`_values_params`.
+    """
+    values = ', '.join('(' + ', '.join(':%s_%d' % (column, index)
+                                       for column in _LOAD_COLUMNS) + ')'
+                       for index in xrange(count))
+    return text(_INSERT_QUERY % values + suffix)
+
+
+def _values_params(rows):
+    params = {}
+    for index, row in enumerate(rows):
+        for column in _LOAD_COLUMNS:
+            params['%s_%d' % (column, index)] = row[column]
+    return params
+
+
+_SPECIAL = re.compile(r'[\\\t\n\0]')
+
+
+def _tsv(value):
+    """Returns a value in the default format of LOAD DATA."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, datetime.datetime):
+        value = value.date().isoformat()
+    elif isinstance(value, datetime.date):
+        value = value.isoformat()
+    elif isinstance(value, unicode):
+        value = value.encode('utf8')
+    elif not isinstance(value, str):
+        value = str(value)
+    if _SPECIAL.search(value) is None:
+        return value
+    return (value.replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\0', '\\0'))
+
+
+def tsv_line(row):
+    """Returns a record row as a line of a file for LOAD DATA."""
+    return '\t'.join([_tsv(row['id']), _tsv(row['date']), _tsv(row['type']),
+                      _tsv(row['source_id']), _tsv(row['value'])]) + '\n'
+
+
 class Database(Plugin):
 
     def __init__(self, **options):
         Plugin.__init__(self, **options)
         self.sqluri = options['database']
-        self.engine = get_engine(self.sqluri)
+        # for large runs, the records can be written in a file loaded
+        # with LOAD DATA LOCAL INFILE on commit
+        self.load_data = boolean(options.get('load_data', False))
+        if self.load_data and not self.sqluri.startswith('mysql'):
+            logger.info('load_data is only supported by MySQL, the records '
+                        'of %s are inserted' % options.get('id', self.sqluri))
+            self.load_data = False
+        elif self.load_data and not local_infile_supported(self.sqluri):
+            logger.info('The MySQL driver does not support load_data, the '
+                        'records of %s are inserted' %
+                        options.get('id', self.sqluri))
+            self.load_data = False
+        self.engine = get_engine(self.sqluri, local_infile=self.load_data)
         self.mysql = 'mysql' in self.engine.driver
+
+        # with upsert, a record is identified by its source, date, type
+        # and dimensions, which are all its keys but the metrics. Runs
+        # then update the records in place instead of clearing them.
+        self.upsert = boolean(options.get('upsert', False))
+        self.metrics = frozenset(metric.strip() for metric in
+                                 options.get('metrics', '').split(',')
+                                 if metric.strip())
+        if self.upsert and not self.metrics:
+            # a changed metric would give the line a new id, and since
+            # the records are not cleared, the old one would stay
+            raise ValueError('upsert needs the metrics of %s' %
+                             options.get('id', self.sqluri))
+        # PyMySQL runs an executemany as a query per row, so the records
+        # are sent to MySQL in multi-row INSERTs instead
+        self._insert_suffix = ''
+        if not self.upsert:
+            self._insert_query = record_table.insert()
+            self._load_query = text(_LOAD_QUERY % '')
+        elif self.mysql:
+            self._insert_suffix = _UPSERT_SUFFIX
+            self._load_query = text(_LOAD_QUERY % 'REPLACE ')
+        else:
+            self._insert_query = record_table.insert().prefix_with(
+                'OR REPLACE')
         self.session_factory = sessionmaker(bind=self.engine, autocommit=False,
                                             autoflush=False)
         self.session = self.session_factory()
         self._transaction = None
+        # the records inserted when the transaction is committed, or
+        # the file they are written in with load_data
+        self._rows = []
+        self._load_file = None
+        self._load_lines = 0
 
         record_table.metadata.bind = self.engine
         record_table.create(checkfirst=True)
         transaction_table.metadata.bind = self.engine
         transaction_table.create(checkfirst=True)
+        run_table.metadata.bind = self.engine
+        run_table.create(checkfirst=True)
 
     @contextmanager
     def transaction(self):
@@ -97,34 +250,140 @@ class Database(Plugin):
             raise ValueError('A transaction is already running')
         self._transaction = self.session_factory()
 
+    def _reset(self):
+        self._transaction = None
+        self._rows = []
+        if self._load_file is not None:
+            # the temporary file is removed once closed
+            self._load_file.close()
+            self._load_file = None
+            self._load_lines = 0
+
+    def _load(self):
+        self._load_file.flush()
+        result = self._transaction.execute(
+            self._load_query, {'filename': self._load_file.name})
+        # with LOCAL, MySQL loads as with IGNORE: the duplicate keys and
+        # the conversion errors are only warnings, and the rows are
+        # skipped or truncated. REPLACE counts a replaced row twice.
+        warnings = self._transaction.execute(
+            text('SHOW WARNINGS LIMIT 10')).fetchall()
+        if warnings or (not self.upsert and
+                        result.rowcount != self._load_lines):
+            self._transaction.rollback()
+            raise InjectError('%d records loaded out of %d: %s' % (
+                result.rowcount, self._load_lines,
+                '; '.join(warning[2] for warning in warnings)))
+
     def commit_transaction(self):
         try:
+            if self._load_file is not None:
+                self._load()
+            elif self._rows:
+                self._execute_inserts(self._rows)
             self._transaction.commit()
         finally:
-            self._transaction = None
+            self._reset()
+
+    def _execute_inserts(self, rows):
+        if not self.mysql:
+            self._transaction.execute(self._insert_query, rows)
+            return
+        full_query = None
+        for start in xrange(0, len(rows), _INSERT_CHUNK):
+            chunk = rows[start:start + _INSERT_CHUNK]
+            if len(chunk) < _INSERT_CHUNK:
+                query = _values_query(len(chunk), self._insert_suffix)
+            else:
+                if full_query is None:
+                    full_query = _values_query(_INSERT_CHUNK,
+                                               self._insert_suffix)
+                query = full_query
+            self._transaction.execute(query, _values_params(chunk))
 
     def rollback_transaction(self):
         try:
             self._transaction.rollback()
         finally:
-            self._transaction = None
+            self._reset()
 
     def in_transaction(self):
         return self._transaction is not None
 
+    def _id(self, source_id, date, type, value):
+        if not self.upsert:
+            # set by _add_ids for the whole batch
+            return None
+        dimensions = dict((key, dimension)
+                          for key, dimension in value.iteritems()
+                          if key not in self.metrics)
+        return natural_uid(source_id, date, type, dimensions)
+
+    def _row(self, source_id, item):
+        # the item is shared with the other targets, so the value stored
+        # in JSON is a copy
+        date, type = item['_date'], item['_type']
+        value = dict(item)
+        del value['_date'], value['_type']
+        return {'id': self._id(source_id, date, type, value), 'date': date,
+                'type': type, 'source_id': source_id,
+                'value': json_dumps(value)}
+
+    def _column_rows(self, source_id, batch):
+        # the values are read from the columns, without a dict per line
+        keys = [key for key in batch.keys if key not in ('_date', '_type')]
+        rows = []
+        for date, type, values in izip(batch.column('_date'),
+                                       batch.column('_type'),
+                                       batch.rows(keys)):
+            value = dict(izip(keys, values))
+            rows.append({'id': self._id(source_id, date, type, value),
+                         'date': date, 'type': type, 'source_id': source_id,
+                         'value': json_dumps(value)})
+        return rows
+
+    def _add_ids(self, rows):
+        # the ids of the records of a date are generated at once, and
+        # are sorted like the records, which are inserted in that order
+        dated = defaultdict(list)
+        for row in rows:
+            dated[row['date']].append(row)
+        for date, date_rows in dated.iteritems():
+            for row, id_ in izip(date_rows,
+                                 urlsafe_uids(len(date_rows), date)):
+                row['id'] = id_
+
+    def _insert(self, rows):
+        if not self.upsert:
+            self._add_ids(rows)
+        # the records are only appended, so they skip the ORM unit of
+        # work, and are inserted on commit, with an executemany or with
+        # multi-row INSERTs with MySQL. Like the ORM did, this keeps
+        # SQLite from locking the database until the commit.
+        with self.transaction():
+            if not self.load_data:
+                self._rows.extend(rows)
+                return
+            # the file is written as the batches come, so the memory
+            # does not grow with the size of the run
+            if self._load_file is None:
+                self._load_file = tempfile.NamedTemporaryFile(
+                    prefix='monolith-', suffix='.tsv')
+            self._load_file.writelines(tsv_line(row) for row in rows)
+            self._load_lines += len(rows)
+
     def inject(self, batch):
-        with self.transaction() as session:
-            records = []
-            for source_id, item in batch:
-                item = dict(item)
-                date = item.pop('_date')
-                type = item.pop('_type')
-                records.append(
-                    Record(id=urlsafe_uid(date),
-                           date=date, type=type,
-                           source_id=source_id,
-                           value=json_dumps(item)))
-            session.add_all(records)
+        self._insert([self._row(source_id, item)
+                      for source_id, item in batch])
+
+    def inject_batches(self, batches):
+        rows = []
+        for source_id, items in batches:
+            if isinstance(items, Columns):
+                rows.extend(self._column_rows(source_id, items))
+            else:
+                rows.extend(self._row(source_id, item) for item in items)
+        self._insert(rows)
 
     def _check(self, data):
         data = dict(data)
@@ -150,16 +409,55 @@ class Database(Plugin):
 
         return data
 
-    def extract(self, start_date, end_date):
+    def _select(self, start_date, end_date):
         query = text(
             'select id AS _id, type AS _type, source_id, date, value '
             'from record where date BETWEEN :start_date and :end_date'
         )
-        data = self.engine.execute(query, start_date=start_date,
+        return self.engine.execute(query, start_date=start_date,
                                    end_date=end_date)
+
+    def extract(self, start_date, end_date):
+        data = self._select(start_date, end_date)
         return (self._check(line) for line in data)
 
+    def _columns(self, lines):
+        # the values of the records may have different keys, so the
+        # lines are split in a batch per set of keys
+        batches, order = {}, []
+        for line in lines:
+            data = self._check(line)
+            keys = tuple(sorted(data))
+            columns = batches.get(keys)
+            if columns is None:
+                columns = batches[keys] = [[] for key in keys]
+                order.append(keys)
+            for column, key in izip(columns, keys):
+                column.append(data[key])
+        return [Columns(batch_keys, batches[batch_keys])
+                for batch_keys in order]
+
+    def extract_batches(self, start_date, end_date):
+        """Yields the lines of the range in columnar batches.
+
+        Each fetch of batch_size records gives a :class:`Columns` batch
+        per set of keys of their values.
+        """
+        data = self._select(start_date, end_date)
+        while True:
+            lines = data.fetchmany(self.batch_size)
+            if not lines:
+                return
+            for batch in self._columns(lines):
+                yield batch
+
     def clear(self, start_date, end_date, source_ids):
+        if self.upsert:
+            # the records are updated in place
+            logger.info('Not clearing %s, its records are upserted' %
+                        self.options.get('id', self.sqluri))
+            return 0
+
         count = 0
         with self.transaction() as session:
             query = session.query(Record).filter(
@@ -190,3 +488,75 @@ class Database(Plugin):
             query = query.filter(Transaction.date <= end_date)
             count = query.count()
         return count > 0
+
+    def get_dates(self, source, start_date, end_date):
+        """Returns the set of dates of a range a source has entries for."""
+        with self.transaction() as session:
+            query = session.query(Transaction.date).distinct()
+            query = query.filter(Transaction.source == source.get_id())
+            query = query.filter(Transaction.date >= start_date)
+            query = query.filter(Transaction.date <= end_date)
+            return set(date for date, in query)
+
+    def get_coverage(self, sources, start_date, end_date):
+        """Returns the days of a range each source has entries for.
+
+        The entries of all the sources are loaded with a single query, in
+        a mapping of source ids to :class:`DateBitmap` instances.
+        """
+        source_ids = [source.get_id() for source in sources]
+        coverage = dict((source_id, DateBitmap(start_date))
+                        for source_id in source_ids)
+        if len(source_ids) == 0:
+            return coverage
+
+        columns = transaction_table.c
+        query = select([columns.source, columns.date]).where(and_(
+            columns.source.in_(source_ids),
+            columns.date >= start_date, columns.date <= end_date))
+
+        with self.transaction() as session:
+            for source_id, date in session.execute(query):
+                coverage[source_id].add(date)
+        return coverage
+
+    def add_entries(self, entries):
+        """Adds (source_id, date) entries in bulk."""
+        if len(entries) == 0:
+            return
+        with self.transaction() as session:
+            session.execute(transaction_table.insert(),
+                            [{'source': source_id, 'date': date}
+                             for source_id, date in entries])
+
+    def add_run(self, report):
+        """Adds a run to the history, given the report of its stats.
+
+        The *arguments* of the report are stored apart from the rest.
+        """
+        report = dict(report)
+        arguments = report.pop('arguments', {})
+        with self.transaction() as session:
+            session.add(Run(started=report['started'],
+                            duration=report.get('duration'),
+                            status=report['status'],
+                            start_date=report.get('start_date'),
+                            end_date=report.get('end_date'),
+                            arguments=json_dumps(arguments),
+                            report=json_dumps(report)))
+
+    def get_runs(self, limit=10):
+        """Returns the reports of the last runs, the most recent first.
+
+        The arguments of each run are put back in its report.
+        """
+        with self.transaction() as session:
+            query = session.query(Run).order_by(Run.started.desc(),
+                                                Run.id.desc())
+            runs = []
+            for run in query.limit(limit):
+                report = json_loads(str(run.report))
+                report['arguments'] = json_loads(str(run.arguments))
+                report['started'] = run.started
+                runs.append(report)
+            return runs
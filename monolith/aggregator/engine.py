@@ -1,131 +1,159 @@
-from functools import partial
+from collections import defaultdict
+import sys
 
 import gevent
-from gevent.pool import Group
 from gevent.queue import Queue
 
-from monolith.aggregator import exception, logger
+from monolith.aggregator import logger
+from monolith.aggregator.db import Database
+from monolith.aggregator.phase import Phase
+from monolith.aggregator.stats import Stats
+from monolith.aggregator.util import date_shards
 
 
 class Engine(object):
 
     def __init__(self, sequence, database, phase_hook=None, batch_size=100,
-                 force=False, retries=3):
+                 force=False, retries=3, queue_size=None,
+                 queue_max_bytes=None, inflight=1, shard=None,
+                 shard_concurrency=1, checkpoints=False, stream=None,
+                 adaptive=False, batch_latency=1.0, batch_max_bytes=None,
+                 min_batch_size=1, max_batch_size=10000, stats=None,
+                 profiler=None):
         self.sequence = sequence
         self.database = database
-        self.queue = Queue()
+        # bounds of the queue of each phase and of each target lane
+        self.queue_size = queue_size
+        self.queue_max_bytes = queue_max_bytes
         self.phase_hook = phase_hook
         self.batch_size = batch_size
         self.force = force
         self.retries = retries
-        self.errors = []
+        # number of batches each target may be writing at the same time,
+        # targets can override it with their own options
+        self.inflight = inflight
+        # when set, the date range is split in shards of a day, a week
+        # or a month, each one run with its own transactions and retries
+        self.shard = shard
+        self.shard_concurrency = shard_concurrency
+        # when True, sources are extracted and checkpointed day by day,
+        # and a failing source does not prevent the others to commit
+        self.checkpoints = checkpoints
+        # when set to day, week or month, phases are pipelined over the
+        # range: a phase runs on a day once its dependencies committed it
+        self.stream = stream
+        # when True, the batch size of each target is tuned so writing
+        # a batch takes about batch_latency seconds, and weighs at most
+        # batch_max_bytes
+        self.adaptive = adaptive
+        self.batch_latency = batch_latency
+        self.batch_max_bytes = batch_max_bytes
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        # last batch size chosen for each target
+        self.batch_sizes = {}
+        # timings and counters of the run, shared with the forks
+        if stats is None:
+            stats = Stats()
+        self.stats = stats
+        # when set, every phase is profiled separately
+        self.profiler = profiler
+        # days committed by each source during the current run
+        self.committed = defaultdict(set)
 
-    def _push_to_target(self, targets):
-        """Get a batch of elements from the queue, and push it to the targets.
+    def _run_phase(self, phase, start_date, end_date):
+        if self.profiler is not None:
+            self.profiler.register(phase[0])
+        return Phase(self, phase, start_date, end_date).run()
 
-        This function returns True if it proceeded all the elements in
-        the queue, and there isn't anything more to read.
+    def _dependencies(self, phases):
+        """Returns a mapping of each phase name to the names of the phases
+        it has to run after.
         """
-        if self.queue.empty():
-            return 0    # nothing
+        dependencies = getattr(self.sequence, 'dependencies', None)
+        if dependencies is not None:
+            return dependencies
 
-        batch = []
-        pushed = 0
+        # a plain list of phases is run in order
+        names = [phase[0] for phase in phases]
+        return dict((name, set(names[index - 1:index]))
+                    for index, name in enumerate(names))
 
-        # collecting a batch
-        while len(batch) < self.batch_size:
-            item = self.queue.get()
-            if item == 'END':
-                pushed += 1  # the 'END' item
-                break
-            batch.append(item)
-
-        if len(batch) != 0:
-            greenlets = Group()
-            for plugin in targets:
-                green = greenlets.spawn(self._put_data, plugin, batch)
-                green.link_exception(partial(self._error,
-                                             exception.InjectError, plugin))
-            greenlets.join()
-            pushed += len(batch)
-
-        return pushed
-
-    #
-    # transaction managment
-    #
-    def _start_transactions(self, plugins):
-        for plugin in plugins:
-            plugin.start_transaction()
-
-    def _commit_transactions(self, plugins):
-        # XXX what happends when this fails?
-        for plugin in plugins:
-            plugin.commit_transaction()
-
-    def _rollback_transactions(self, plugins):
-        for plugin in plugins:
-            plugin.rollback_transaction()
-
-    def _put_data(self, plugin, data):
-        return plugin.inject(data)
-
-    def _get_data(self, plugin, start_date, end_date):
+    def _try_phase(self, phase, start_date, end_date):
         try:
-            for item in plugin.extract(start_date, end_date):
-                self.queue.put((plugin.get_id(), item))
-        finally:
-            self.queue.put('END')
+            self._retry(phase[0], self._run_phase, phase, start_date,
+                        end_date)
+        except Exception:
+            return sys.exc_info()
 
-    def _log_transaction(self, source, start_date, end_date, greenlet):
-        self.database.add_entry([source], start_date, end_date)
+    def _run_phases(self, start_date, end_date):
+        """Runs the phases of the sequence.
 
-    def _error(self, exception, plugin, greenlet):
-        self.errors.append((exception, plugin, greenlet))
+        A phase starts as soon as the phases it depends on are over, so
+        independent phases run at the same time. Phases sharing a target
+        never run at the same time, since targets hold their transaction.
 
-    def _run_phase(self, phase, start_date, end_date):
-        phase, sources, targets = phase
-        logger.info('Running phase %r' % phase)
-        self._reset_counters()
-
-        self._start_transactions(targets)
-        self.database.start_transaction()
-        try:
-            greenlets = Group()
-            # each callable will push its result in the queue
-            for source in sources:
-                exists = self.database.exists(source, start_date, end_date)
-                if exists and not self.force:
-                    logger.info('Already done: %s, %s to %s' % (
-                        source.get_id(), start_date, end_date))
+        When streaming, each phase is run day by day (or week by week...)
+        and starts on a day as soon as the phases it depends on committed
+        that day, while they go on with the next days.
+        """
+        phases = list(self.sequence)
+        dependencies = self._dependencies(phases)
+        if self.stream is None:
+            ranges = [(start_date, end_date)]
+        else:
+            ranges = date_shards(start_date, end_date, self.stream)
+
+        # every task is a phase to run on a range, with the tasks
+        # it has to wait for
+        tasks = []
+        for index, range_ in enumerate(ranges):
+            for phase in phases:
+                name = phase[0]
+                waits = set((dependency, range_)
+                            for dependency in dependencies[name])
+                if index > 0:
+                    waits.add((name, ranges[index - 1]))
+                tasks.append(((name, range_), phase, waits))
+
+        done = set()
+        running = {}
+        finished = Queue()
+        failure = None
+
+        while True:
+            busy = set()
+            for phase, green in running.values():
+                busy.update(phase[2])
+
+            for key, phase, waits in tasks:
+                if (failure is not None or key in done or key in running
+                        or not waits <= done
+                        or busy.intersection(phase[2])):
                     continue
 
-                green = greenlets.spawn(self._get_data, source,
-                                        start_date, end_date)
-                green.link_value(partial(self._log_transaction, source,
-                                         start_date, end_date))
-                green.link_exception(partial(self._error,
-                                             exception.ExtractError, source))
-
-            # looking at the queue
-            pushed = 0
-
-            while len(greenlets) > 0 or self.queue.qsize() > 0:
-                gevent.sleep(0)
-                pushed += self._push_to_target(targets)
-                # let's see if we have some errors
-                if len(self.errors) > 0:
-                    # yeah! we need to rollback
-                    # XXX later we'll do a source-by-source rollback
-                    raise exception.RunError(self.errors)
+                green = gevent.spawn(self._try_phase, phase, *key[1])
+                green.link(finished.put)
+                running[key] = phase, green
+                busy.update(phase[2])
 
-        except Exception:
-            self._rollback_transactions(targets)
-            self.database.rollback_transaction()
-            raise
-        else:
-            self._commit_transactions(targets)
-            self.database.commit_transaction()
+            if len(running) == 0:
+                break
+
+            # waiting for one of the running tasks to be over
+            green = finished.get()
+            for key, (phase, running_green) in running.items():
+                if running_green is green:
+                    del running[key]
+                    break
+
+            if green.value is None:
+                done.add(key)
+            elif failure is None:
+                failure = green.value
+
+        if failure is not None:
+            raise failure[0], failure[1], failure[2]
 
     def _clear(self, start_date, end_date):
         source_ids = set()
@@ -148,37 +176,95 @@ class Engine(object):
                 except Exception:
                     logger.error('Failed to purge %r' % source.get_id())
 
-    def _retry(self, func, *args, **kw):
+    def _retry(self, name, func, *args, **kw):
+        # the retries are counted in the stats of the name phase
         tries = 0
         retries = self.retries
         while tries < retries:
+            if tries > 0:
+                self.stats.add('phases', name, 'retries')
             try:
                 return func(*args, **kw)
-            except Exception, exc:
-                self.queue.queue.clear()
+            except Exception:
                 logger.exception('%s failed (%d/%d)' % (func, tries + 1,
                                                         retries))
                 tries += 1
         raise
 
-    def _reset_counters(self):
-        self.errors = []
+    def _fork(self):
+        """Returns a copy of the engine, with its own plugins and database.
+
+        The copy can run concurrently with this engine.
+        """
+        database = Database(database=self.database.sqluri)
+        return Engine(self.sequence.clone(), database,
+                      phase_hook=self.phase_hook, batch_size=self.batch_size,
+                      force=self.force, retries=self.retries,
+                      queue_size=self.queue_size,
+                      queue_max_bytes=self.queue_max_bytes,
+                      inflight=self.inflight, checkpoints=self.checkpoints,
+                      stream=self.stream, adaptive=self.adaptive,
+                      batch_latency=self.batch_latency,
+                      batch_max_bytes=self.batch_max_bytes,
+                      min_batch_size=self.min_batch_size,
+                      max_batch_size=self.max_batch_size,
+                      stats=self.stats, profiler=self.profiler)
+
+    def _run_shards(self, shards, purge_only, failures):
+        for start_date, end_date in shards:
+            try:
+                self._run_range(start_date, end_date, purge_only)
+            except Exception:
+                logger.exception('Shard %s to %s failed' % (start_date,
+                                                            end_date))
+                failures.append((start_date, end_date))
+
+    def _report_batch_sizes(self):
+        for target_id, size in sorted(self.batch_sizes.items()):
+            logger.info('Batch size of %r: %d' % (target_id, size))
 
     def run(self, start_date, end_date, purge_only=False):
-        self._reset_counters()
+        if self.shard is None:
+            try:
+                return self._run_range(start_date, end_date, purge_only)
+            finally:
+                self._report_batch_sizes()
+
+        shards = date_shards(start_date, end_date, self.shard)
+        concurrency = min(self.shard_concurrency, len(shards))
+        if concurrency > 1:
+            engines = [self._fork() for i in range(concurrency)]
+        else:
+            engines = [self]
+
+        # every engine picks the next shard once it's done with one
+        shards = iter(shards)
+        failures = []
+        gevent.joinall([gevent.spawn(engine._run_shards, shards, purge_only,
+                                     failures) for engine in engines])
+        for engine in engines:
+            self.batch_sizes.update(engine.batch_sizes)
+        self._report_batch_sizes()
+
+        if len(failures) > 0:
+            logger.error('%d shard(s) failed: %s' % (
+                len(failures), ', '.join('%s to %s' % shard
+                                         for shard in sorted(failures))))
+            return 1
+        return 0
+
+    def _run_range(self, start_date, end_date, purge_only=False):
+        self.committed = defaultdict(set)
 
         if not purge_only:
             # overwrite / clear data
             if self.force:
-                self._retry(self._clear, start_date, end_date)
-
-            for phase in self.sequence:
-                if self.queue.qsize() > 0:
-                    raise ValueError('The queue still has %d elements' %
-                                     self.queue.qsize())
+                with self.stats.timer('phases', 'clear'):
+                    self._retry('clear', self._clear, start_date, end_date)
 
-                self._retry(self._run_phase, phase, start_date, end_date)
+            self._run_phases(start_date, end_date)
 
         # purging
-        self._retry(self._purge, start_date, end_date)
+        with self.stats.timer('phases', 'purge'):
+            self._retry('purge', self._purge, start_date, end_date)
         return 0
@@ -10,26 +10,93 @@ from monolith.aggregator.util import (configure_logger, LOG_LEVELS,
 from monolith.aggregator.db import Database
 from monolith.aggregator.sequence import Sequence
 from monolith.aggregator.engine import Engine
+from monolith.aggregator.profiler import Profiler
+from monolith.aggregator.stats import Stats
 
 
 def _mkdate(datestring):
     return datetime.strptime(datestring, '%Y-%m-%d').date()
 
 
+def _get(parser, option, default=None):
+    try:
+        return parser.get('monolith', option)
+    except NoOptionError:
+        return default
+
+
+def _getint(parser, option, default=None):
+    try:
+        return parser.getint('monolith', option)
+    except NoOptionError:
+        return default
+
+
+def _report(parser, stats):
+    """Logs the stats of the run, and sends them where configured."""
+    logger.info('Report: %s' % stats.to_json())
+
+    path = _get(parser, 'report')
+    if path is not None:
+        with open(path, 'w') as f:
+            f.write(stats.to_json())
+
+    prefix = _get(parser, 'metrics_prefix', 'monolith')
+    path = _get(parser, 'prometheus_textfile')
+    if path is not None:
+        stats.write_prometheus(path, prefix)
+
+    statsd = _get(parser, 'statsd')
+    if statsd is not None:
+        host, port = (statsd.split(':', 1) + ['8125'])[:2]
+        stats.send_statsd(host, int(port), prefix)
+
+
 def extract(config, start_date, end_date, sequence=None, batch_size=None,
-            force=False, purge_only=False, retries=3):
+            force=False, purge_only=False, retries=3, profile=None):
     """Reads the configuration file and does the job.
+
+    When *profile* is a directory, every phase is profiled and its
+    pstats and collapsed stacks files are written there.
     """
     defaults = {'here': os.path.abspath(os.path.dirname(config))}
     parser = ConfigParser(defaults=defaults)
     parser.read(config)
 
+    if batch_size is None:
+        # using the default value
+        batch_size = 100
+    batch_size = _getint(parser, 'batch_size', batch_size)
+
+    # bounding the queue between the sources and the targets
+    queue_size = _getint(parser, 'queue_size')
+    queue_max_bytes = _getint(parser, 'queue_max_bytes')
+
+    # how many batches each target may be writing at the same time
+    inflight = _getint(parser, 'inflight_batches', 1)
+
+    # splitting the date range in shards
+    shard = _get(parser, 'shard')
+    shard_concurrency = _getint(parser, 'shard_concurrency', 1)
+
+    # pipelining the phases day by day
+    stream = _get(parser, 'stream')
+
+    # checkpointing every source, day by day
     try:
-        batch_size = parser.get('monolith', 'batch_size')
+        checkpoints = parser.getboolean('monolith', 'checkpoints')
     except NoOptionError:
-        # using the default value
-        if batch_size is None:
-            batch_size = 100
+        checkpoints = False
+
+    # tuning the batch size of each target
+    try:
+        adaptive = parser.getboolean('monolith', 'adaptive_batch_size')
+    except NoOptionError:
+        adaptive = False
+    batch_latency = float(_get(parser, 'batch_latency', 1.0))
+    batch_max_bytes = _getint(parser, 'batch_max_bytes')
+    min_batch_size = _getint(parser, 'min_batch_size', 1)
+    max_batch_size = _getint(parser, 'max_batch_size', 10000)
 
     # creating the sequence
     sequence = Sequence(parser, sequence)
@@ -47,15 +114,59 @@ def extract(config, start_date, end_date, sequence=None, batch_size=None,
     database = Database(database=monolith_db)
 
     # run the engine
+    stats = Stats()
+    profiler = None
+    if profile is not None:
+        profiler = Profiler(profile)
+
     engine = Engine(sequence, database, batch_size=batch_size, force=force,
-                    retries=retries)
-    return engine.run(start_date, end_date, purge_only)
+                    retries=retries, queue_size=queue_size,
+                    queue_max_bytes=queue_max_bytes, inflight=inflight,
+                    shard=shard, shard_concurrency=shard_concurrency,
+                    checkpoints=checkpoints, stream=stream,
+                    adaptive=adaptive, batch_latency=batch_latency,
+                    batch_max_bytes=batch_max_bytes,
+                    min_batch_size=min_batch_size,
+                    max_batch_size=max_batch_size, stats=stats,
+                    profiler=profiler)
+
+    arguments = {'config': config, 'sequence': sequence.names,
+                 'batch_size': batch_size, 'force': force,
+                 'purge_only': purge_only, 'retries': retries,
+                 'profile': profile}
+    stats.start(start_date=start_date, end_date=end_date,
+                arguments=arguments)
+    res = 1
+    if profiler is not None:
+        profiler.start()
+    try:
+        res = engine.run(start_date, end_date, purge_only)
+        return res
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.write()
+        stats.stop(res == 0 and 'success' or 'failure')
+        try:
+            _report(parser, stats)
+            database.add_run(stats.report())
+        except Exception:
+            logger.exception('Failed to report the stats')
 
 
 _DATES = ['today', 'yesterday', 'last-week', 'last-month',
           'last-year']
 
 
+def _monkey_patch():
+    # the plugins use blocking clients (urllib3, PyMySQL, httplib2, boto),
+    # which only let the other greenlets run once the standard library
+    # is patched. Without it, in-flight batches, shards and concurrent
+    # phases wait for each other's I/O.
+    from gevent import monkey
+    monkey.patch_all()
+
+
 def main():
     parser = argparse.ArgumentParser(description='Monolith Aggregator')
 
@@ -87,8 +198,17 @@ def main():
                         help='Only run the purge of sources.')
     parser.add_argument('--retries', default=3, type=int,
                         help='Number of retries')
+    parser.add_argument('--profile', default=None, metavar='DIR',
+                        help='Profiles every phase, and writes the pstats '
+                             'and collapsed stacks files in DIR.')
+    parser.add_argument('--no-monkey-patch', action='store_true',
+                        default=False,
+                        help='Does not monkey-patch the standard library.')
     args = parser.parse_args()
 
+    if not args.no_monkey_patch:
+        _monkey_patch()
+
     if args.version:
         print(__version__)
         sys.exit(0)
@@ -102,7 +222,7 @@ def main():
 
     configure_logger(logger, args.loglevel, args.logoutput)
     res = extract(args.config, start, end, args.sequence, args.batch_size,
-                  args.force, args.purge_only)
+                  args.force, args.purge_only, args.retries, args.profile)
 
     if res == 0:
         logger.info('SUCCESS')
@@ -0,0 +1,96 @@
+import argparse
+import os
+from ConfigParser import ConfigParser, NoOptionError
+import sys
+
+from monolith.aggregator.db import Database
+
+
+def trends(runs, kind='sources', counter='records_per_sec'):
+    """Returns a counter of every phase, source or target over the runs.
+
+    *runs* are reports of runs, the most recent first. The result maps
+    each element to its values, the oldest run first, with None for the
+    runs it was not part of.
+    """
+    runs = list(reversed(runs))
+    names = set()
+    for run in runs:
+        names.update(run.get(kind, {}))
+
+    return dict((name, [run.get(kind, {}).get(name, {}).get(counter)
+                        for run in runs])
+                for name in names)
+
+
+def _change(rates):
+    rates = [rate for rate in rates if rate]
+    if len(rates) < 2:
+        return ''
+    return '%+.1f%%' % ((rates[-1] - rates[0]) * 100. / rates[0])
+
+
+def _format(value, format='%.1f'):
+    if value is None:
+        return '-'
+    return format % value
+
+
+_TRENDS = [('Seconds per phase', 'phases', 'time'),
+           ('Records per second of the sources', 'sources',
+            'records_per_sec'),
+           ('Records per second of the targets', 'targets',
+            'records_per_sec')]
+
+
+def report(runs, output=sys.stdout):
+    """Writes the runs and the throughput trends of their sources and
+    targets.
+    """
+    if len(runs) == 0:
+        output.write('No runs.\n')
+        return
+
+    output.write('Last %d runs:\n\n' % len(runs))
+    for run in reversed(runs):
+        output.write('%s  %-8s %10ss  %s to %s\n' % (
+            run['started'].strftime('%Y-%m-%d %H:%M:%S'), run['status'],
+            _format(run.get('duration')), run.get('start_date'),
+            run.get('end_date')))
+
+    for title, kind, counter in _TRENDS:
+        output.write('\n%s, oldest run first:\n\n' % title)
+        for name, values in sorted(trends(runs, kind, counter).items()):
+            output.write('%-30s %s  %s\n' % (
+                name, ' '.join('%10s' % _format(value) for value in values),
+                _change(values)))
+
+
+def history(config, runs=10, output=sys.stdout):
+    """Reads the configuration file and reports the last *runs* runs."""
+    defaults = {'here': os.path.abspath(os.path.dirname(config))}
+    parser = ConfigParser(defaults=defaults)
+    parser.read(config)
+
+    try:
+        monolith_db = parser.get('monolith', 'database')
+    except NoOptionError:  # pragma: no cover
+        # BBB support old history config name
+        monolith_db = parser.get('monolith', 'history')
+
+    database = Database(database=monolith_db)
+    report(database.get_runs(runs), output)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Monolith Aggregator runs history')
+    parser.add_argument('config', help='Configuration file.')
+    parser.add_argument('--runs', default=10, type=int,
+                        help='Number of runs to report.')
+    args = parser.parse_args()
+    history(args.config, args.runs)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+import time
+
+import gevent
+from gevent.pool import Pool
+
+from monolith.aggregator.queues import END, SizedQueue, lines, sizeof
+
+
+class BatchSizer(object):
+    """Tunes a batch size toward a target latency and payload size.
+
+    After each batch, the time and the bytes per line are estimated
+    with a moving average, and the size is set to the number of lines
+    that would take *latency* seconds to write, or weigh *max_bytes*.
+    The size is kept between *min_size* and *max_size*, and at most
+    doubles at each step.
+    """
+    def __init__(self, size, latency=1.0, max_bytes=None, min_size=1,
+                 max_size=10000, smoothing=0.5):
+        self.latency = latency
+        self.max_bytes = max_bytes
+        self.min_size = min_size
+        self.max_size = max_size
+        self.smoothing = smoothing
+        self.size = self._clamp(size)
+        self._line_time = None
+        self._line_bytes = None
+
+    def _clamp(self, size):
+        return int(max(self.min_size, min(self.max_size, size)))
+
+    def _average(self, previous, value):
+        if previous is None:
+            return value
+        return self.smoothing * value + (1 - self.smoothing) * previous
+
+    def update(self, lines, duration, bytes=None):
+        """Updates the size given the time it took to write a batch."""
+        if lines == 0:
+            return self.size
+
+        self._line_time = self._average(self._line_time,
+                                        float(duration) / lines)
+        if self._line_time > 0:
+            size = self.latency / self._line_time
+        else:
+            size = self.max_size
+
+        if self.max_bytes is not None and bytes is not None:
+            self._line_bytes = self._average(self._line_bytes,
+                                             float(bytes) / lines)
+            size = min(size, self.max_bytes / self._line_bytes)
+
+        self.size = self._clamp(min(size, self.size * 2))
+        return self.size
+
+
+class Lane(object):
+    """Delivers the lines of a phase to a single target.
+
+    The lines come in (source_id, items) tuples, and are written in
+    batches of such tuples holding *batch_size* lines, the last tuple
+    of a batch being cut if needed.
+
+    Each lane has its own queue, batch size and number of in-flight
+    batches, so a slow target does not hold back the other ones as
+    long as its queue is not full.
+
+    *inject* is called with the target and a batch, in a greenlet.
+    When a :class:`BatchSizer` is provided, the batch size is tuned
+    after each batch.
+    """
+    def __init__(self, target, inject, batch_size=100, inflight=1,
+                 queue_size=None, queue_max_bytes=None, sizer=None):
+        self.target = target
+        self.inject = inject
+        self.sizer = sizer
+        if sizer is not None:
+            batch_size = sizer.size
+        self.batch_size = batch_size
+        self.queue = SizedQueue(queue_size, queue_max_bytes, lines)
+        self.pool = Pool(inflight)
+        # the rest of a tuple cut by the previous batch
+        self._rest = None
+
+    def put(self, element):
+        self.queue.put(element)
+
+    def close(self):
+        """Tells the lane no more lines are coming."""
+        self.queue.put(END)
+
+    def _get_batch(self):
+        """Blocks until a batch of lines is read from the queue.
+
+        Returns a tuple of (batch, ended). The batch is cut short when
+        the lane is closed, in which case ended is True.
+        """
+        batch, count = [], 0
+        while count < self.batch_size:
+            if self._rest is not None:
+                element, self._rest = self._rest, None
+            else:
+                element = self.queue.get()
+            if element == END:
+                return batch, True
+
+            source_id, items = element
+            missing = self.batch_size - count
+            if len(items) > missing:
+                self._rest = source_id, items[missing:]
+                items = items[:missing]
+            batch.append((source_id, items))
+            count += len(items)
+        return batch, False
+
+    def _write(self, batch):
+        if self.sizer is None:
+            return self.inject(self.target, batch)
+
+        start = time.time()
+        res = self.inject(self.target, batch)
+        bytes = None
+        if self.sizer.max_bytes is not None:
+            bytes = sizeof(batch)
+        count = sum(len(items) for source_id, items in batch)
+        self.batch_size = self.sizer.update(count, time.time() - start,
+                                            bytes)
+        return res
+
+    def run(self):
+        """Feeds the target until the lane is closed.
+
+        The next batch is collected while the previous ones are still
+        being written. Returns once all the batches are written.
+        """
+        try:
+            ended = False
+            while not ended:
+                batch, ended = self._get_batch()
+                if batch:
+                    self.pool.spawn(self._write, batch)
+
+            # waiting for the batches still being written
+            self.pool.join()
+        except gevent.GreenletExit:
+            self.pool.kill()
+            raise
@@ -0,0 +1,299 @@
+from functools import partial
+
+import gevent
+from gevent.event import Event
+from gevent.pool import Group
+
+from monolith.aggregator import exception, logger
+from monolith.aggregator.lane import BatchSizer, Lane
+from monolith.aggregator.queues import END, SizedQueue, lines
+from monolith.aggregator.util import boolean, contiguous_ranges, date_range
+
+
+class Phase(object):
+    """Runs a phase once: extracts its sources and feeds its targets.
+
+    A phase has its own queue and errors, so several phases can run
+    at the same time as long as they don't share targets.
+    """
+    def __init__(self, engine, phase, start_date, end_date):
+        self.engine = engine
+        self.name, self.sources, self.targets = phase
+        self.start_date = start_date
+        self.end_date = end_date
+        # when bounded, sources block in _get_data until the targets
+        # caught up, so memory scales with the batch size instead of
+        # with the date range. The sources queue lists of lines.
+        self.queue = SizedQueue(engine.queue_size, engine.queue_max_bytes,
+                                lines)
+        self.errors = []
+        self.deferred_errors = []
+        self._coverage = {}
+        self._entries = []
+        self._wakeup = Event()
+        self.stats = engine.stats
+
+    def _inject(self, plugin, batch):
+        try:
+            return self._put_data(plugin, batch)
+        except Exception:
+            self._error(exception.InjectError, plugin, gevent.getcurrent())
+            raise
+
+    def _lane(self, plugin):
+        """Creates the delivery lane of a target.
+
+        The target section can override the batch_size, inflight_batches,
+        queue_size and queue_max_bytes options of the engine, as well
+        as the adaptive batch sizing options.
+        """
+        engine = self.engine
+        options = getattr(plugin, 'options', {})
+
+        def _option(name, default, type_=int):
+            value = options.get(name)
+            if value is None:
+                return default
+            return type_(value)
+
+        batch_size = _option('batch_size', engine.batch_size)
+        sizer = None
+        if _option('adaptive_batch_size', engine.adaptive, boolean):
+            # starting from the size chosen by the previous phases
+            batch_size = engine.batch_sizes.get(plugin.get_id(), batch_size)
+            sizer = BatchSizer(
+                batch_size,
+                latency=_option('batch_latency', engine.batch_latency,
+                                float),
+                max_bytes=_option('batch_max_bytes', engine.batch_max_bytes),
+                min_size=_option('min_batch_size', engine.min_batch_size),
+                max_size=_option('max_batch_size', engine.max_batch_size))
+
+        return Lane(plugin, self._inject, batch_size=batch_size,
+                    inflight=_option('inflight_batches', engine.inflight),
+                    queue_size=_option('queue_size', engine.queue_size),
+                    queue_max_bytes=_option('queue_max_bytes',
+                                            engine.queue_max_bytes),
+                    sizer=sizer)
+
+    def _consume(self, sources):
+        """Dispatches the lines to the targets until the sources are done.
+
+        *sources* is the number of running sources. The consumer sleeps
+        on the queue, and stops early if an error happens. Each target
+        is fed by its own lane.
+        """
+        lanes = [self._lane(plugin) for plugin in self.targets]
+        greenlets = [gevent.spawn(lane.run) for lane in lanes]
+        for lane, green in zip(lanes, greenlets):
+            green.link_exception(partial(self._error,
+                                         exception.InjectError, lane.target))
+        try:
+            while sources > 0 and not self.errors:
+                element = self.queue.get()
+                if element == END:
+                    sources -= 1
+                    continue
+                # the lanes share the lists, the targets must not
+                # modify them
+                for lane in lanes:
+                    lane.put(element)
+
+            for lane in lanes:
+                lane.close()
+            gevent.joinall(greenlets)
+
+            self.stats.peak('queues', 'phase:%s' % self.name, 'peak',
+                            self.queue.peak)
+            for lane in lanes:
+                self.stats.peak('queues', lane.target.get_id(), 'peak',
+                                lane.queue.peak)
+                if lane.sizer is not None:
+                    self.engine.batch_sizes[lane.target.get_id()] = \
+                        lane.batch_size
+        except gevent.GreenletExit:
+            gevent.killall(greenlets)
+            raise
+
+    #
+    # transaction managment
+    #
+    def _start_transactions(self, plugins):
+        for plugin in plugins:
+            plugin.start_transaction()
+
+    def _commit_transactions(self, plugins):
+        # XXX what happends when this fails?
+        for plugin in plugins:
+            with self.stats.timer('targets', plugin.get_id(), 'commit_time'):
+                plugin.commit_transaction()
+
+    def _rollback_transactions(self, plugins):
+        for plugin in plugins:
+            plugin.rollback_transaction()
+
+    def _put_data(self, plugin, batch):
+        """Writes a batch of (source_id, items) tuples in a target."""
+        target_id = plugin.get_id()
+        with self.stats.timer('targets', target_id):
+            res = plugin.inject_batches(batch)
+        self.stats.add('targets', target_id, 'batches')
+        self.stats.add('targets', target_id, 'records',
+                       sum(len(items) for source_id, items in batch))
+        return res
+
+    def _get_data(self, plugin, ranges):
+        """Extracts a source for each (start_date, end_date) range."""
+        source_id = plugin.get_id()
+        records = 0
+        try:
+            # the time includes the waits on a full queue
+            with self.stats.timer('sources', source_id):
+                for start_date, end_date in ranges:
+                    for items in plugin.extract_batches(start_date,
+                                                        end_date):
+                        self.queue.put((source_id, items))
+                        records += len(items)
+        finally:
+            self.stats.add('sources', source_id, 'records', records)
+            # the consumer may be gone, and the queue full
+            self.queue.put(END, force=True)
+
+    def _get_days(self, plugin, days):
+        """Extracts a source one day at a time, checkpointing each day.
+
+        The lines of a day are queued only once the whole day was
+        extracted, so a failure never leaves a partial day behind.
+        """
+        source_id = plugin.get_id()
+        try:
+            with self.stats.timer('sources', source_id):
+                for day in days:
+                    batches = list(plugin.extract_batches(day, day))
+                    for items in batches:
+                        self.queue.put((source_id, items))
+                    self._entries.append((source_id, day))
+                    self.stats.add('sources', source_id, 'records',
+                                   sum(len(items) for items in batches))
+        finally:
+            self.queue.put(END, force=True)
+
+    def _todo(self, source):
+        """Returns the days a source still has to extract."""
+        start_date, end_date = self.start_date, self.end_date
+        if self.engine.force:
+            # days committed by a previous try of this run are kept
+            done = self.engine.committed[source.get_id()]
+            return [day for day in date_range(start_date, end_date)
+                    if day not in done]
+        return self._coverage[source.get_id()].missing(start_date, end_date)
+
+    def _log_transaction(self, source, ranges, greenlet):
+        for start_date, end_date in ranges:
+            self._entries.extend((source.get_id(), day)
+                                 for day in date_range(start_date, end_date))
+
+    def _error(self, exception, plugin, greenlet):
+        self.errors.append((exception, plugin, greenlet))
+        self._wakeup.set()
+
+    def _defer_error(self, exception, plugin, greenlet):
+        # the phase goes on, and fails once the other sources are committed
+        self.deferred_errors.append((exception, plugin, greenlet))
+
+    def _spawn_sources(self, greenlets):
+        """Spawns a greenlet for each source that has something to do.
+
+        Each greenlet pushes its lines in the queue.
+        """
+        database = self.engine.database
+        if not self.engine.force:
+            self._coverage = database.get_coverage(
+                self.sources, self.start_date, self.end_date)
+
+        for source in self.sources:
+            days = self._todo(source)
+            if len(days) == 0:
+                logger.info('Already done: %s, %s to %s' % (
+                    source.get_id(), self.start_date, self.end_date))
+                continue
+
+            if self.engine.checkpoints:
+                green = greenlets.spawn(self._get_days, source, days)
+                green.link_exception(partial(self._defer_error,
+                                             exception.ExtractError,
+                                             source))
+                continue
+
+            # only extracting the missing days
+            ranges = contiguous_ranges(days)
+            if ranges != [(self.start_date, self.end_date)]:
+                logger.info('Extracting %s for %s' % (
+                    source.get_id(), ', '.join('%s to %s' % range_
+                                               for range_ in ranges)))
+
+            green = greenlets.spawn(self._get_data, source, ranges)
+            green.link_value(partial(self._log_transaction, source,
+                                     ranges))
+            green.link_exception(partial(self._error,
+                                         exception.ExtractError, source))
+
+    def _count_failures(self, errors):
+        self.stats.add('phases', self.name, 'failures')
+        for plugin in set(error[1] for error in errors):
+            if plugin is None:
+                continue
+            kind = plugin in self.sources and 'sources' or 'targets'
+            self.stats.add(kind, plugin.get_id(), 'failures')
+
+    def run(self):
+        logger.info('Running phase %r, %s to %s' % (
+            self.name, self.start_date, self.end_date))
+        self.stats.add('phases', self.name, 'runs')
+        with self.stats.timer('phases', self.name):
+            return self._run()
+
+    def _run(self):
+        self._start_transactions(self.targets)
+        greenlets = Group()
+        consumer = None
+        try:
+            self._spawn_sources(greenlets)
+
+            consumer = gevent.spawn(self._consume, len(greenlets))
+            consumer.link(lambda green: self._wakeup.set())
+            consumer.link_exception(partial(self._error,
+                                            exception.InjectError, None))
+
+            # sleeping until the targets got everything, or an error
+            self._wakeup.wait()
+            if not self.errors:
+                # makes sure the sources callbacks were all called
+                greenlets.join()
+
+            if len(self.errors) > 0:
+                # yeah! we need to rollback
+                # XXX later we'll do a source-by-source rollback
+                raise exception.RunError(self.errors)
+
+        except Exception:
+            try:
+                # sources may be blocked on a full queue
+                greenlets.kill()
+                if consumer is not None:
+                    consumer.kill()
+            finally:
+                self._count_failures(self.errors)
+                self._rollback_transactions(self.targets)
+            raise
+        else:
+            self._commit_transactions(self.targets)
+            self.engine.database.add_entries(self._entries)
+
+            for source_id, day in self._entries:
+                self.engine.committed[source_id].add(day)
+
+            if len(self.deferred_errors) > 0:
+                # the failed sources will resume from their last checkpoint
+                self._count_failures(self.deferred_errors)
+                raise exception.RunError(self.deferred_errors)
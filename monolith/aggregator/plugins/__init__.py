@@ -1,13 +1,49 @@
+from itertools import islice
+
+
 class Plugin(object):
+    # the number of lines per list yielded by extract_batches
+    batch_size = 100
+
     def __init__(self, **options):
         self.options = options
 
     def extract(self, start_date, end_date):
         raise NotImplementedError(self)
 
+    def extract_batches(self, start_date, end_date):
+        """Yields the lines of the range in lists.
+
+        The engine moves these lists around instead of single lines.
+        By default, the lines of :meth:`extract` are grouped in lists of
+        *batch_size* lines; sources producing their lines in bulk can
+        yield them directly.
+        """
+        lines = iter(self.extract(start_date, end_date))
+        while True:
+            batch = list(islice(lines, self.batch_size))
+            if not batch:
+                return
+            yield batch
+
     def inject(self, batch):
         raise NotImplementedError(self)
 
+    def inject_batches(self, batches):
+        """Writes an iterable of (source_id, items) tuples.
+
+        This is what the engine calls. By default, the lines are handed
+        to :meth:`inject` in a single list of (source_id, item) tuples;
+        targets can override it to consume the lists as they come.
+
+        The lists and the lines are shared by all the targets of a
+        phase, and must not be modified: a target needing a modified
+        line copies it.
+        """
+        return self.inject([(source_id, item)
+                            for source_id, items in batches
+                            for item in items])
+
     def clear(self, start_date, end_date, source_ids):
         pass
 
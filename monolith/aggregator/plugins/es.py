@@ -1,9 +1,13 @@
 from collections import defaultdict
+from itertools import izip
 
 import elasticsearch
 from elasticsearch import helpers
 
+from monolith.aggregator import logger
+from monolith.aggregator.columns import Columns
 from monolith.aggregator.plugins import Plugin
+from monolith.aggregator.util import boolean
 
 
 class ESSetup(object):
@@ -82,6 +86,9 @@ class ESWrite(Plugin):
         self.options = options
         self.url = options['url']
         self.prefix = options.get('prefix', '')
+        # with upsert, the documents are indexed with the deterministic
+        # ids of an upserting sql source, so reruns overwrite them
+        self.upsert = boolean(options.get('upsert', False))
         self.client = elasticsearch.Elasticsearch(hosts=[self.url])
         self.setup = ESSetup(self.client)
         self.setup.configure_templates()
@@ -100,31 +107,59 @@ class ESWrite(Plugin):
         holder = defaultdict(list)
         # sort data into index/type buckets
         for source_id, item in batch:
-            # XXX use source_id as a key with dates for updates
-            item = dict(item)
-            date = item['date']
-            index = self._index_name(date)
-            _type = item.pop('_type')
-            holder[(index, _type)].append(item)
+            self._sort(holder, item)
+        self._submit(holder)
 
+    def inject_batches(self, batches):
+        holder = defaultdict(list)
+        for source_id, items in batches:
+            if isinstance(items, Columns):
+                self._sort_columns(holder, items)
+                continue
+            for item in items:
+                self._sort(holder, item)
+        self._submit(holder)
+
+    def _sort(self, holder, item):
+        # the item is shared with the other targets, so the indexed
+        # document is a copy
+        index = self._index_name(item['date'])
+        source = dict(item)
+        del source['_type'], source['_id']
+        holder[(index, item['_type'])].append((item['_id'], source))
+
+    def _sort_columns(self, holder, batch):
+        keys = [key for key in batch.keys if key != '_type' and key != '_id']
+        for _type, _id, values in izip(batch.column('_type'),
+                                       batch.column('_id'),
+                                       batch.rows(keys)):
+            source = dict(izip(keys, values))
+            holder[(self._index_name(source['date']), _type)].append(
+                (_id, source))
+
+    def _submit(self, holder):
         # submit one bulk request per index/type combination
         for key, docs in holder.items():
             actions = [
-                {'_index': key[0], '_type': key[1], '_id': doc.pop('_id'),
-                 '_source': doc} for doc in docs]
+                {'_index': key[0], '_type': key[1], '_id': _id,
+                 '_source': source} for _id, source in docs]
             resp = helpers.bulk(self.client, actions)
             for res in resp[1]:
                 if res['index'].get('ok'):
                     continue
                 error = res['index'].get('error')
                 if error is not None:
-                    msg = 'Could not index %s' % str(docs[index])
+                    msg = 'Could not index %s' % res['index'].get('_id')
                     msg += '\nES Error:\n'
                     msg += error
                     msg += '\n The data may have been partially imported.'
                     raise ValueError(msg)
 
     def clear(self, start_date, end_date, source_ids):
+        if self.upsert:
+            logger.info('Not clearing %s, its documents are overwritten' %
+                        self.options.get('id', self.url))
+            return
         start_date_str = start_date.strftime('%Y-%m-%d')
         end_date_str = end_date.strftime('%Y-%m-%d')
 
@@ -5,9 +5,15 @@ from monolith.aggregator.util import json_dumps
 class FileWriter(Plugin):
 
     def __init__(self, **options):
+        super(FileWriter, self).__init__(**options)
         self._filename = options['filename']
         self._file = open(self._filename, 'w+')
 
     def inject(self, batch):
         for source, data in batch:
             self._file.write('%s\n' % json_dumps(data))
+
+    def inject_batches(self, batches):
+        for source, items in batches:
+            self._file.writelines('%s\n' % json_dumps(data)
+                                  for data in items)
@@ -15,7 +15,7 @@ from monolith.aggregator.util import date_range, json_loads
 SOURCE_APP_NAME = 'monolith-aggregator-v%s' % __version__
 
 
-def get_service(**options):
+def get_service(discovery_url=None, **options):
     creds = OAuth2Credentials(
         *[options[k] for k in
           ('access_token', 'client_id', 'client_secret',
@@ -23,7 +23,10 @@ def get_service(**options):
            'user_agent')])
     h = httplib2.Http()
     creds.authorize(h)
-    return build('analytics', 'v3', http=h)
+    if discovery_url is None:
+        return build('analytics', 'v3', http=h)
+    # e.g. a stand-in server
+    return build('analytics', 'v3', http=h, discoveryServiceUrl=discovery_url)
 
 
 def _ga(name):
@@ -44,7 +47,7 @@ class BaseGoogleAnalytics(Plugin):
         with open(options['oauth_token']) as f:
             token = json_loads(f.read())
 
-        self.client = get_service(**token)
+        self.client = get_service(options.get('discovery_url'), **token)
         self.profile_id = _ga(options['profile_id'])
         self.metrics = _gatable(options['metrics'])
         self.qmetrics = ','.join(self.metrics)
@@ -1,8 +1,13 @@
+from bisect import bisect
 import datetime
+from itertools import izip
+import math
 import random
 from uuid import uuid1
 
+from monolith.aggregator.columns import Columns
 from monolith.aggregator.plugins import Plugin
+from monolith.aggregator.util import date_range
 
 
 class RandomGenerator(Plugin):
@@ -23,7 +28,7 @@ class RandomGenerator(Plugin):
             uuids[addon] = uuid1().hex
 
         for addon in range(addons):
-            for delta in range((end_date - start_date).days):
+            for delta in range((end_date - start_date).days + 1):
                 date = start_date + datetime.timedelta(days=delta)
                 yield {'_date': date,
                        '_type': 'downloads',
@@ -32,3 +37,166 @@ class RandomGenerator(Plugin):
                        'users_count': random.randint(10000, 15000),
                        'add_on': addon + 1,
                        'app_uuid': uuids.get(addon)}
+
+
+def _weights(option, default):
+    """Parses a "name:weight, name:weight" option."""
+    if option is None:
+        return default
+    weights = []
+    for item in option.split(','):
+        name, weight = item.strip().rsplit(':', 1)
+        weights.append((name.strip(), int(weight)))
+    return weights
+
+
+class SyntheticGenerator(Plugin):
+    """Generates lots of deterministic lines, fast.
+
+    Options:
+
+    - **seed**: the same seed always gives the same lines for a day,
+      whatever the extracted range. Defaults to 0.
+    - **records**: the number of lines per day. Defaults to 1000.
+    - **types**: the mix of _type values, as "name:weight" pairs.
+      Defaults to "downloads:1".
+    - **dimensions**: the dimensions of the lines and their number of
+      distinct values, as "name:cardinality" pairs. Defaults to
+      "os:3, add_on:100".
+    - **skew**: the exponent of the Zipf distribution of the values of
+      the dimensions, 0 being uniform. Defaults to 0.
+    - **width**: the number of integer fields added to every line.
+      Defaults to 2.
+    - **batch_size**: the number of lines generated at once. Defaults
+      to 1000.
+
+    Values are drawn once in pools, then every batch takes a slice of
+    each pool at a random offset and is yielded as columns, so a line
+    costs next to nothing until a dict is built for it. Because of
+    that, a dimension never has more than pool_size distinct values.
+    """
+    pool_size = 2 ** 16
+
+    def __init__(self, **options):
+        Plugin.__init__(self, **options)
+        self.seed = int(options.get('seed', 0))
+        self.records = int(options.get('records', 1000))
+        self.skew = float(options.get('skew', 0))
+        self.width = int(options.get('width', 2))
+        self.batch_size = min(int(options.get('batch_size', 1000)),
+                              self.pool_size)
+
+        rng = random.Random(self.seed)
+        types = _weights(options.get('types'), [('downloads', 1)])
+        self._types = self._pool(rng, [name for name, weight in types],
+                                 [weight for name, weight in types])
+
+        dimensions = _weights(options.get('dimensions'),
+                              [('os', 3), ('add_on', 100)])
+        self._keys = ['_date', '_type']
+        self._pools = [self._types]
+        for name, cardinality in dimensions:
+            # past pool_size, the values and the weights of the tail are
+            # not listed
+            head, tail = cardinality, None
+            if cardinality > self.pool_size:
+                head = self.pool_size
+                values = _LazyValues(name, cardinality)
+                tail = _ZipfTail(head, cardinality, self.skew)
+            else:
+                values = ['%s-%d' % (name, index)
+                          for index in range(cardinality)]
+            weights = [1. / (index + 1) ** self.skew
+                       for index in range(head)]
+            self._keys.append(name)
+            self._pools.append(self._pool(rng, values, weights, tail))
+
+        numbers = [rng.randint(0, 10000) for i in range(self.pool_size)]
+        for index in range(self.width):
+            self._keys.append('value_%d' % index)
+            self._pools.append(numbers + numbers)
+
+    def _pool(self, rng, values, weights, tail=None):
+        # the pool is doubled so any slice of pool_size lines is contiguous
+        total, cumulative = 0, []
+        for weight in weights:
+            total += weight
+            cumulative.append(total)
+        if tail is not None:
+            total += tail.weight
+        pool = []
+        for i in range(self.pool_size):
+            index = bisect(cumulative, rng.random() * total)
+            if index == len(cumulative):
+                index = tail.index(rng.random())
+            pool.append(values[index])
+        return pool + pool
+
+    def _batches(self, day):
+        rng = random.Random(self.seed * 1000003 + day.toordinal())
+        keys, size = self._keys, self.pool_size
+        left = self.records
+        while left > 0:
+            count = min(left, self.batch_size)
+            left -= count
+            columns = [[day] * count]
+            for pool in self._pools:
+                offset = rng.randint(0, size - 1)
+                columns.append(pool[offset:offset + count])
+            yield Columns(keys, columns)
+
+    def extract_batches(self, start_date, end_date):
+        """Yields the lines of the range, in columnar batches of
+        batch_size lines.
+        """
+        for day in date_range(start_date, end_date):
+            for batch in self._batches(day):
+                yield batch
+
+    def extract(self, start_date, end_date):
+        keys = self._keys
+        for batch in self.extract_batches(start_date, end_date):
+            for row in batch.rows():
+                yield dict(izip(keys, row))
+
+
+class _LazyValues(object):
+    # the values of a dimension with a high cardinality, built on demand
+    def __init__(self, name, cardinality):
+        self.name = name
+        self.cardinality = cardinality
+
+    def __getitem__(self, index):
+        return '%s-%d' % (self.name, index)
+
+
+class _ZipfTail(object):
+    """The indexes from *start* to *stop* of a Zipf distribution.
+
+    The weight of an index is 1 / (index + 1) ** skew. The weights of
+    the tail are approximated by an integral, which is inverted to draw
+    an index, so they are never listed.
+    """
+    def __init__(self, start, stop, skew):
+        self.start = start
+        self.stop = stop
+        self.skew = skew
+        # the sum of the weights from start to stop is close to the
+        # integral of x ** -skew from start + 0.5 to stop + 0.5
+        self._low = self._integral(start + 0.5)
+        self.weight = self._integral(stop + 0.5) - self._low
+
+    def _integral(self, x):
+        if self.skew == 1:
+            return math.log(x)
+        return x ** (1 - self.skew) / (1 - self.skew)
+
+    def _inverse(self, y):
+        if self.skew == 1:
+            return math.exp(y)
+        return ((1 - self.skew) * y) ** (1 / (1 - self.skew))
+
+    def index(self, share):
+        """Returns the index below which *share* of the weight is."""
+        x = self._inverse(self._low + share * self.weight)
+        return min(max(int(x - 0.5), self.start), self.stop - 1)
@@ -4,7 +4,7 @@ import os
 from collections import defaultdict
 from ConfigParser import ConfigParser
 
-from boto.s3.connection import S3Connection
+from boto.s3.connection import OrdinaryCallingFormat, S3Connection
 
 from monolith.aggregator import logger
 from monolith.aggregator.exception import ServerError
@@ -32,6 +32,13 @@ class SolitudeReader(TastypieReader):
         self.bucket_name = parser.get('auth', 'bucket', None)
         self.bucket = None
 
+        # an S3 compatible server can be used instead of Amazon's
+        self.s3_host = self.s3_port = None
+        if parser.has_option('auth', 'host'):
+            self.s3_host = parser.get('auth', 'host')
+        if parser.has_option('auth', 'port'):
+            self.s3_port = parser.getint('auth', 'port')
+
     def get_s3_file(self, date):
         """
         Connects to S3 bucket and looks for a file with name formatted like
@@ -39,7 +46,13 @@ class SolitudeReader(TastypieReader):
         lists, one list of items per record.
         """
         if not self.bucket:
-            conn = S3Connection(self.access_key, self.secret_key)
+            if self.s3_host is None:
+                conn = S3Connection(self.access_key, self.secret_key)
+            else:
+                conn = S3Connection(self.access_key, self.secret_key,
+                                    host=self.s3_host, port=self.s3_port,
+                                    is_secure=False,
+                                    calling_format=OrdinaryCallingFormat())
             self.bucket = conn.get_bucket(self.bucket_name)
 
         key = self.bucket.get_key(date.strftime(self.filename_format))
@@ -0,0 +1,145 @@
+from collections import defaultdict
+import cProfile
+import os
+import pstats
+import signal
+
+import greenlet
+
+from monolith.aggregator import logger
+
+
+# the bucket of the greenlets that don't belong to a phase
+OTHER = '_other'
+
+
+def _collapse(frame):
+    """Returns the stack of a frame as a semicolon separated string,
+    the outermost call first.
+    """
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append('%s:%s:%d' % (os.path.basename(code.co_filename),
+                                   code.co_name, code.co_firstlineno))
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+
+class Profiler(object):
+    """Profiles each phase of a run separately.
+
+    cProfile follows a single stack, so every greenlet gets its own
+    profile, enabled only while it runs. The greenlets a phase spawns,
+    directly or not, are accounted to that phase, and their profiles
+    are merged once they are over.
+
+    On top of that, the stack of the running greenlet is sampled every
+    *interval* seconds of CPU time, to build flame graphs.
+
+    Once stopped, a *phase*.pstats and a *phase*.collapsed file are
+    written in *directory* for every phase.
+    """
+    def __init__(self, directory, interval=0.001):
+        self.directory = directory
+        self.interval = interval
+        # the greenlets running each phase
+        self._roots = {}
+        # greenlet -> (phase, profile) for the running greenlets
+        self._profiles = {}
+        self._stats = {}
+        self._samples = defaultdict(lambda: defaultdict(int))
+        self._previous_trace = None
+        self._previous_handler = None
+
+    def register(self, phase):
+        """Accounts the current greenlet, and the ones it spawns, to
+        *phase*.
+        """
+        current = greenlet.getcurrent()
+        self._roots[current] = phase
+        if current in self._profiles:
+            self._profiles[current] = phase, self._profiles[current][1]
+
+    def _phase(self, green):
+        while green is not None:
+            if green in self._roots:
+                return self._roots[green]
+            # gevent keeps a reference to the greenlet that spawned it
+            spawning = getattr(green, 'spawning_greenlet', None)
+            green = spawning is not None and spawning() or None
+        return OTHER
+
+    def _profile(self, green):
+        if green not in self._profiles:
+            self._profiles[green] = self._phase(green), cProfile.Profile()
+        return self._profiles[green][1]
+
+    def _merge(self, green):
+        phase, profile = self._profiles.pop(green)
+        profile.disable()
+        profile.create_stats()
+        if len(profile.stats) == 0:
+            return
+        if phase not in self._stats:
+            self._stats[phase] = pstats.Stats(profile)
+        else:
+            self._stats[phase].add(profile)
+
+    def _trace(self, event, args):
+        if event in ('switch', 'throw'):
+            origin, target = args
+            if origin in self._profiles:
+                if origin.dead:
+                    self._merge(origin)
+                else:
+                    self._profiles[origin][1].disable()
+            self._profile(target).enable()
+
+        if self._previous_trace is not None:
+            self._previous_trace(event, args)
+
+    def _sample(self, signum, frame):
+        phase = self._phase(greenlet.getcurrent())
+        self._samples[phase][_collapse(frame)] += 1
+
+    def start(self):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        self._previous_trace = greenlet.settrace(self._trace)
+        self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+        # restart the system calls the signal interrupts, instead of
+        # failing them with EINTR
+        signal.siginterrupt(signal.SIGPROF, False)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self._profile(greenlet.getcurrent()).enable()
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0)
+        signal.signal(signal.SIGPROF, self._previous_handler or
+                      signal.SIG_DFL)
+        greenlet.settrace(self._previous_trace)
+        for green in self._profiles.keys():
+            self._merge(green)
+        self._roots.clear()
+
+    def write(self):
+        """Writes the profiles and the collapsed stacks of each phase.
+
+        Returns the list of files written.
+        """
+        files = []
+        for phase, stats in self._stats.items():
+            path = os.path.join(self.directory, '%s.pstats' % phase)
+            stats.dump_stats(path)
+            files.append(path)
+
+        for phase, samples in self._samples.items():
+            path = os.path.join(self.directory, '%s.collapsed' % phase)
+            with open(path, 'w') as f:
+                for stack, count in sorted(samples.items()):
+                    f.write('%s %d\n' % (stack, count))
+            files.append(path)
+
+        logger.info('Profiles written in %s' % self.directory)
+        return files
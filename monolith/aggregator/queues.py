@@ -0,0 +1,137 @@
+import sys
+from collections import deque
+
+from gevent.event import Event
+from gevent.queue import Full, Queue
+
+from monolith.aggregator.columns import Columns
+
+
+# put in a queue by a producer once it's done
+END = 'END'
+
+
+def sizeof(obj, _getsizeof=sys.getsizeof):
+    """Returns the approximate size in bytes of a queued element.
+
+    Mappings are measured one level deep and sequences and columnar
+    batches are walked recursively, which is enough for the
+    (source_id, items) tuples the engine pushes around.
+    """
+    size = _getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.iteritems():
+            size += _getsizeof(key) + _getsizeof(value)
+    elif isinstance(obj, (tuple, list)):
+        for value in obj:
+            size += sizeof(value)
+    elif isinstance(obj, Columns):
+        size += sizeof(obj.columns)
+    return size
+
+
+def lines(element):
+    """Returns the number of lines of a queued (source_id, items) tuple."""
+    if element == END:
+        return 0
+    return len(element[1])
+
+
+class SizedQueue(Queue):
+    """A gevent queue bounded by a number of items and/or a number of bytes.
+
+    *maxsize* works like in :class:`gevent.queue.Queue`. When *max_bytes*
+    is set, :meth:`put` also blocks as long as the approximate size of the
+    queued elements is over the limit. A single element is always accepted
+    in an empty queue, whatever its size, so the queue never deadlocks.
+
+    When the elements are batches, *count* returns the number of lines
+    of an element, and *maxsize* then bounds the number of queued lines
+    the same way *max_bytes* bounds their size.
+
+    *peak* is the highest number of elements, or lines, the queue held.
+
+    With *force*, :meth:`put` ignores *max_bytes* and the lines budget,
+    so a producer can always signal it is done, even once the consumer
+    stopped reading.
+    """
+    def __init__(self, maxsize=None, max_bytes=None, count=None):
+        self.count = count
+        self.max_lines = None
+        if count is not None:
+            self.max_lines, maxsize = maxsize, None
+        Queue.__init__(self, maxsize)
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.lines = 0
+        self.peak = 0
+        self._sizes = deque()
+        self._counts = deque()
+        # the producers waiting for room, served in turn
+        self._putters = deque()
+
+    def _over_budget(self):
+        if self.qsize() == 0:
+            return False
+        return ((self.max_bytes is not None and
+                 self.bytes >= self.max_bytes) or
+                (self.max_lines is not None and
+                 self.lines >= self.max_lines))
+
+    def _blocked(self, waiter):
+        return self._putters[0] is not waiter or self._over_budget()
+
+    def _wake_putter(self):
+        if self._putters:
+            self._putters[0].set()
+
+    def put(self, item, block=True, timeout=None, force=False):
+        if not force and (self._putters or self._over_budget()):
+            if not block:
+                raise Full
+            # the producers wait in turn, otherwise one that never
+            # yields would always take the room back first
+            waiter = Event()
+            self._putters.append(waiter)
+            try:
+                while self._blocked(waiter):
+                    waiter.clear()
+                    waiter.wait(timeout)
+                    if timeout is not None and self._blocked(waiter):
+                        raise Full
+            finally:
+                self._putters.remove(waiter)
+                self._wake_putter()
+        Queue.put(self, item, block, timeout)
+
+    def _put(self, item):
+        if self.max_bytes is not None:
+            size = sizeof(item)
+            self._sizes.append(size)
+            self.bytes += size
+        Queue._put(self, item)
+        if self.count is not None:
+            count = self.count(item)
+            self._counts.append(count)
+            self.lines += count
+            self.peak = max(self.peak, self.lines)
+        elif len(self.queue) > self.peak:
+            self.peak = len(self.queue)
+
+    def _get(self):
+        item = Queue._get(self)
+        if self.max_bytes is not None:
+            self.bytes -= self._sizes.popleft()
+        if self.count is not None:
+            self.lines -= self._counts.popleft()
+        self._wake_putter()
+        return item
+
+    def clear(self):
+        """Drops all the queued elements."""
+        self.queue.clear()
+        self._sizes.clear()
+        self._counts.clear()
+        self.bytes = 0
+        self.lines = 0
+        self._wake_putter()
@@ -17,6 +17,7 @@ class Sequence(object):
                 raise ValueError("You need to define a sequence.")
 
         sequence = [phase.strip() for phase in sequence.split(',')]
+        self.names = sequence
         self.config = defaultdict(dict)
         keys = ('phase', 'source', 'target')
 
@@ -31,6 +32,11 @@ class Sequence(object):
 
         # a sequence is made of phases
         self._sequence = [self._build_phase(phase) for phase in sequence]
+        self.dependencies = self._build_dependencies(sequence)
+
+    def clone(self):
+        """Returns a new sequence, with its own plugin instances."""
+        return Sequence(self.parser, ','.join(self.names))
 
     def __iter__(self):
         return self._sequence.__iter__()
@@ -52,6 +58,41 @@ class Sequence(object):
                    for source in options['sources'].split(',')]
         return phase, sources, targets
 
+    def _build_dependencies(self, sequence):
+        """Returns a mapping of each phase to the phases it runs after.
+
+        A phase without an **after** option runs after the previous
+        phase of the sequence. Phases that are not part of the sequence
+        are ignored, so a single phase can still be replayed.
+        """
+        dependencies = {}
+        for index, phase in enumerate(sequence):
+            options = self.config['phase'][phase]
+            if 'after' not in options:
+                dependencies[phase] = set(sequence[index - 1:index])
+                continue
+
+            after = [name.strip() for name in options['after'].split(',')
+                     if name.strip() != '']
+            for name in after:
+                if name not in self.config['phase']:
+                    raise ValueError('%r phase is undefined' % name)
+            dependencies[phase] = set(name for name in after
+                                      if name in sequence)
+
+        # making sure the phases can all be run
+        done = set()
+        while len(done) < len(sequence):
+            ready = [phase for phase in sequence if phase not in done and
+                     dependencies[phase] <= done]
+            if len(ready) == 0:
+                raise ValueError('Circular dependency between the phases '
+                                 '%s' % ', '.join(sorted(set(sequence) -
+                                                         done)))
+            done.update(ready)
+
+        return dependencies
+
     def _load_plugin(self, type_, name, options):
         logger.debug('Loading %s:%s' % (type_, name))
         source_id = type_, options['id']
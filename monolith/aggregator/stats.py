@@ -0,0 +1,124 @@
+from contextlib import contextmanager
+from datetime import datetime
+import os
+import socket
+import time
+
+from monolith.aggregator.util import json_dumps
+
+
+# the kinds of elements the stats are collected for
+KINDS = ('phases', 'sources', 'targets', 'queues')
+
+
+class Stats(object):
+    """Collects the timings and counters of a run.
+
+    Counters are kept per kind (phases, sources, targets and queues)
+    and per name, e.g. the number of records a source extracted or the
+    time a target spent writing. Greenlets update them in turn, so no
+    locking is needed.
+    """
+    def __init__(self):
+        self.counters = dict((kind, {}) for kind in KINDS)
+        self.started = self.ended = None
+        self.status = None
+        self.info = {}
+
+    def _get(self, kind, name):
+        return self.counters[kind].setdefault(name, {})
+
+    def add(self, kind, name, counter, value=1):
+        counters = self._get(kind, name)
+        counters[counter] = counters.get(counter, 0) + value
+
+    def peak(self, kind, name, counter, value):
+        """Keeps the highest value seen for a counter."""
+        counters = self._get(kind, name)
+        counters[counter] = max(counters.get(counter, 0), value)
+
+    @contextmanager
+    def timer(self, kind, name, counter='time'):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(kind, name, counter, time.time() - start)
+
+    def start(self, **info):
+        """Starts the run. *info* is added to the report."""
+        self.info.update(info)
+        self.started = time.time()
+
+    def stop(self, status):
+        self.ended = time.time()
+        self.status = status
+
+    def report(self):
+        """Returns the stats as a mapping, ready to be dumped in JSON.
+
+        A rate in records per second is added to the sources and targets.
+        """
+        report = dict(self.info)
+        report['status'] = self.status
+        if self.started is not None:
+            report['started'] = datetime.utcfromtimestamp(self.started)
+            report['duration'] = (self.ended or time.time()) - self.started
+
+        for kind, elements in self.counters.items():
+            report[kind] = {}
+            for name, counters in elements.items():
+                counters = dict(counters)
+                if counters.get('time') and 'records' in counters:
+                    counters['records_per_sec'] = (counters['records'] /
+                                                   counters['time'])
+                report[kind][name] = counters
+        return report
+
+    def to_json(self):
+        return json_dumps(self.report())
+
+    def _metrics(self, report):
+        # flattens the report into (kind, name, counter, value) tuples
+        if 'duration' in report:
+            yield 'run', None, 'duration', report['duration']
+        for kind in KINDS:
+            for name, counters in sorted(report[kind].items()):
+                for counter, value in sorted(counters.items()):
+                    yield kind, name, counter, value
+
+    def to_prometheus(self, prefix='monolith'):
+        """Returns the stats in the Prometheus text format."""
+        report = self.report()
+        lines = []
+        for kind, name, counter, value in self._metrics(report):
+            metric = '%s_%s_%s' % (prefix, kind.rstrip('s'), counter)
+            if name is None:
+                lines.append('%s %s' % (metric, value))
+            else:
+                lines.append('%s{name="%s"} %s' % (metric, name, value))
+        lines.append('%s_run_success %d' % (prefix,
+                                            report['status'] == 'success'))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, prefix='monolith'):
+        """Writes the stats to a textfile read by the node exporter."""
+        # the exporter must never read a half-written file
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(self.to_prometheus(prefix))
+        os.rename(tmp, path)
+
+    def send_statsd(self, host, port=8125, prefix='monolith'):
+        """Sends the stats to statsd, as gauges."""
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for kind, name, counter, value in self._metrics(self.report()):
+                if name is None:
+                    metric = '%s.%s.%s' % (prefix, kind, counter)
+                else:
+                    name = name.replace('.', '_').replace(':', '_')
+                    metric = '%s.%s.%s.%s' % (prefix, kind, name, counter)
+                sock.sendto('%s:%s|g' % (metric, value), (host, port))
+        finally:
+            sock.close()
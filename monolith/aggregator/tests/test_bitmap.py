@@ -0,0 +1,33 @@
+from datetime import date, timedelta
+
+from unittest2 import TestCase
+
+from monolith.aggregator.bitmap import DateBitmap
+
+
+class TestDateBitmap(TestCase):
+
+    def test_bitmap(self):
+        origin = date(2013, 1, 1)
+        days = [origin + timedelta(days=day) for day in (0, 2, 3, 400)]
+        bitmap = DateBitmap(origin, days)
+
+        self.assertEqual(len(bitmap), 4)
+        for day in days:
+            self.assertTrue(day in bitmap)
+        self.assertFalse(date(2013, 1, 2) in bitmap)
+        self.assertFalse(date(2012, 12, 31) in bitmap)
+        self.assertRaises(ValueError, bitmap.add, date(2012, 12, 31))
+
+    def test_missing(self):
+        origin = date(2013, 1, 1)
+        bitmap = DateBitmap(origin, [date(2013, 1, 2), date(2013, 1, 4)])
+        self.assertEqual(bitmap.missing(origin, date(2013, 1, 5)),
+                         [date(2013, 1, 1), date(2013, 1, 3),
+                          date(2013, 1, 5)])
+        self.assertEqual(bitmap.missing(date(2013, 1, 4), date(2013, 1, 4)),
+                         [])
+
+        # ranges can start before the origin
+        self.assertEqual(bitmap.missing(date(2012, 12, 31), origin),
+                         [date(2012, 12, 31), origin])
@@ -0,0 +1,49 @@
+import datetime
+from unittest2 import TestCase
+
+from monolith.aggregator.columns import Columns
+from monolith.aggregator.queues import sizeof
+from monolith.aggregator.util import json_dumps
+
+
+class TestColumns(TestCase):
+
+    def setUp(self):
+        self.items = [{'_type': 'downloads', 'os': 'os-%d' % i, 'count': i}
+                      for i in range(5)]
+        self.batch = Columns.from_items(self.items)
+
+    def test_rows(self):
+        batch = self.batch
+        self.assertEqual(len(batch), 5)
+        self.assertEqual(batch.column('count'), range(5))
+        self.assertEqual(list(batch), self.items)
+        self.assertEqual(batch[-1], self.items[-1])
+        self.assertRaises(IndexError, batch.__getitem__, 5)
+        self.assertEqual(list(batch.rows(['os', 'count']))[1], ('os-1', 1))
+
+        row = batch[2]
+        self.assertEqual(row['os'], 'os-2')
+        self.assertEqual(dict(row), self.items[2])
+        self.assertRaises(KeyError, row.__getitem__, 'foo')
+
+    def test_slice(self):
+        rest = self.batch[3:]
+        self.assertTrue(isinstance(rest, Columns))
+        self.assertEqual(list(rest), self.items[3:])
+        self.assertEqual(len(self.batch[5:]), 0)
+        self.assertEqual(len(Columns.from_items([])), 0)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, Columns, ['a', 'b'], [[1]])
+
+    def test_serialize(self):
+        batch = Columns(['_date', 'count'], [[datetime.date(2013, 1, 1)],
+                                             [1]])
+        self.assertEqual(json_dumps(batch[0]),
+                         json_dumps({'_date': '2013-01-01', 'count': 1}))
+
+    def test_sizeof(self):
+        self.assertTrue(sizeof(self.batch) > sizeof(self.batch.columns[0]))
+        # the keys are not repeated on each line
+        self.assertTrue(sizeof(self.batch) < sizeof(self.items))
@@ -0,0 +1,457 @@
+from ConfigParser import ConfigParser
+from functools import partial
+import datetime
+import os
+import tempfile
+
+import gevent
+from unittest2 import TestCase
+
+from monolith.aggregator.db import Database, Record
+from monolith.aggregator.exception import RunError
+from monolith.aggregator.engine import Engine
+from monolith.aggregator.plugins import Plugin
+from monolith.aggregator.sequence import Sequence
+from monolith.aggregator.util import date_range
+
+
+TODAY = datetime.date.today()
+
+
+class Source(Plugin):
+
+    def __init__(self, **options):
+        options.setdefault('count', 100)
+        Plugin.__init__(self, **options)
+        # when set, records the number of lines the target did not get yet
+        self.target = None
+        self.pending = []
+
+    def extract(self, start_date, end_date):
+        for i in range(int(self.options['count'])):
+            if self.target is not None:
+                received = sum(len(batch) for batch in self.target.batches)
+                self.pending.append(i - received)
+            gevent.sleep(float(self.options.get('delay', 0)))
+            yield {'_type': 'test', '_date': start_date, 'value': i}
+
+
+class FailingSource(Plugin):
+
+    def extract(self, start_date, end_date):
+        yield {'_type': 'test', '_date': start_date}
+        if start_date <= self.options.get('date', start_date) <= end_date:
+            raise ValueError('boom')
+
+
+class FlakySource(Source):
+    """Fails once on a given date."""
+
+    def __init__(self, **options):
+        Source.__init__(self, **options)
+        self.calls = []
+
+    def extract(self, start_date, end_date):
+        self.calls.append((start_date, end_date))
+        for item in Source.extract(self, start_date, end_date):
+            yield item
+            if self.options.get('date') == start_date:
+                del self.options['date']
+                raise ValueError('boom')
+
+
+class Target(Plugin):
+
+    def __init__(self, **options):
+        Plugin.__init__(self, **options)
+        self.batches = []
+        self.committed = []
+        self.committed_batches = []
+        self.injected = 0
+
+    def inject(self, batch):
+        self.batches.append(batch)
+        self.injected += len(batch)
+
+    def commit_transaction(self):
+        for batch in self.batches:
+            self.committed.extend(batch)
+        self.committed_batches.extend(self.batches)
+        self.batches = []
+
+    def rollback_transaction(self):
+        self.batches = []
+
+
+class SlowTarget(Target):
+
+    def __init__(self, **options):
+        Target.__init__(self, **options)
+        self.running = self.max_running = 0
+
+    def inject(self, batch):
+        self.running += 1
+        self.max_running = max(self.running, self.max_running)
+        gevent.sleep(0.01)
+        Target.inject(self, batch)
+        self.running -= 1
+
+
+class BatchSource(Plugin):
+
+    def extract_batches(self, start_date, end_date):
+        for i in range(3):
+            yield [{'_type': 'test', '_date': start_date, 'value': i}] * 7
+
+
+class LongSource(Plugin):
+    """Extracts a lot of lines, without ever waiting."""
+
+    def __init__(self, **options):
+        Plugin.__init__(self, **options)
+        self.calls = 0
+
+    def extract_batches(self, start_date, end_date):
+        self.calls += 1
+        for i in xrange(10000):
+            yield [{'_type': 'test', '_date': start_date, 'value': i}] * 10
+
+
+class BatchTarget(Target):
+
+    def inject_batches(self, batches):
+        self.batches.append(list(batches))
+
+
+class FailingTarget(Target):
+
+    def __init__(self, **options):
+        Target.__init__(self, **options)
+        self.rollbacks = 0
+
+    def inject(self, batch):
+        raise ValueError('boom')
+
+    def rollback_transaction(self):
+        Target.rollback_transaction(self)
+        self.rollbacks += 1
+
+
+def _parser(sections):
+    parser = ConfigParser()
+    for section, options in sections.items():
+        parser.add_section(section)
+        if ':' in section and not section.startswith('phase:'):
+            parser.set(section, 'id', section.split(':')[1])
+        for option, value in options.items():
+            parser.set(section, option, value)
+    return parser
+
+
+class TestEngine(TestCase):
+
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp()
+        os.close(fd)
+        self.database = Database(database='sqlite:///%s' % self.filename)
+
+    def tearDown(self):
+        os.remove(self.filename)
+
+    def _engine(self, sources, targets, **options):
+        sequence = [('extract', sources, targets)]
+        return Engine(sequence, self.database, **options)
+
+    def test_run(self):
+        source, target = Source(id='source'), Target(id='target')
+        engine = self._engine([source], [target], batch_size=10)
+        engine.run(TODAY, TODAY)
+        self.assertEqual(len(target.committed), 100)
+        self.assertTrue(self.database.exists(source, TODAY, TODAY))
+
+    def test_stats(self):
+        target = Target(id='target')
+        sources = [Source(id='source'), FlakySource(id='flaky', date=TODAY)]
+        engine = self._engine(sources, [target], batch_size=10)
+        engine.run(TODAY, TODAY)
+
+        report = engine.stats.report()
+        self.assertEqual(report['phases']['extract']['runs'], 2)
+        self.assertEqual(report['phases']['extract']['retries'], 1)
+        self.assertEqual(report['sources']['flaky']['failures'], 1)
+        # the records of the failed run are counted as well
+        self.assertTrue(report['sources']['source']['records'] >= 100)
+        self.assertTrue(report['targets']['target']['records'] >= 200)
+        self.assertTrue(report['targets']['target']['batches'] >= 20)
+        self.assertTrue('commit_time' in report['targets']['target'])
+        self.assertTrue('time' in report['phases']['purge'])
+        self.assertTrue(report['queues']['phase:extract']['peak'] > 0)
+
+    def test_bounded_queue(self):
+        source, target = Source(id='source'), Target(id='target')
+        source.batch_size = 5
+        engine = self._engine([source], [target], batch_size=10,
+                              queue_size=15)
+        source.target = target
+        engine.run(TODAY, TODAY)
+        self.assertEqual(len(target.committed), 100)
+        # the list being filled, the phase queue and the target lane
+        # queue (each one can get a list over their size) and a batch
+        self.assertTrue(max(source.pending) <= 5 + 20 + 20 + 10)
+
+    def test_batches(self):
+        sources = [BatchSource(id='batches'), Source(id='source', count=5)]
+        target, legacy = BatchTarget(id='target'), Target(id='legacy')
+        engine = self._engine(sources, [target, legacy], batch_size=10)
+        engine.run(TODAY, TODAY)
+
+        # the lists of the sources are passed along, cut in batches
+        lines = [(source_id, len(items))
+                 for batch in target.committed_batches
+                 for source_id, items in batch]
+        self.assertEqual(sum(count for source_id, count in lines), 26)
+        self.assertTrue(len(lines) < 10)
+        for batch in target.committed_batches[:-1]:
+            self.assertEqual(sum(len(items) for source_id, items in batch),
+                             10)
+
+        # legacy targets get (source_id, item) tuples
+        self.assertEqual(len(legacy.committed), 26)
+        self.assertEqual(sorted(set(source_id for source_id, item
+                                    in legacy.committed)),
+                         ['batches', 'source'])
+
+    def test_source_error(self):
+        target = Target(id='target')
+        sources = [Source(id='source'), FailingSource(id='failing')]
+        engine = self._engine(sources, [target], retries=1)
+        self.assertRaises(RunError, engine.run, TODAY, TODAY)
+        self.assertEqual(target.committed, [])
+        self.assertFalse(self.database.exists(sources[0], TODAY, TODAY))
+
+    def test_target_error(self):
+        targets = [Target(id='target'), FailingTarget(id='failing')]
+        engine = self._engine([Source(id='source')], targets, retries=1)
+        try:
+            engine.run(TODAY, TODAY)
+        except RunError, exc:
+            self.assertEqual(exc.errors[0][1], targets[1])
+        else:
+            raise AssertionError('RunError not raised')
+        self.assertEqual(targets[0].committed, [])
+
+    def test_bounded_queue_target_error(self):
+        # the source blocked on the full queue is killed, and the phase
+        # is rolled back and retried
+        source = LongSource(id='source')
+        target = FailingTarget(id='failing')
+        engine = self._engine([source], [target], batch_size=10,
+                              queue_size=50, retries=2)
+        with gevent.Timeout(10):
+            self.assertRaises(RunError, engine.run, TODAY, TODAY)
+        self.assertEqual(target.rollbacks, 2)
+        self.assertEqual(source.calls, 2)
+
+    def test_bounded_queue_source_error(self):
+        # a source failing while the queue is full fails the phase at
+        # once, instead of waiting for room for its END
+        source, target = LongSource(id='source'), Target(id='target')
+        failing = FailingSource(id='failing')
+        failing.batch_size = 1
+        engine = self._engine([source, failing], [target], batch_size=10,
+                              queue_size=50, retries=1)
+        with gevent.Timeout(10):
+            self.assertRaises(RunError, engine.run, TODAY, TODAY)
+        # the other source was stopped before it queued everything
+        self.assertTrue(target.injected < 1000, target.injected)
+
+    def test_inflight(self):
+        target = SlowTarget(id='target')
+        engine = self._engine([Source(id='source')], [target],
+                              batch_size=10, inflight=3)
+        engine.run(TODAY, TODAY)
+        self.assertEqual(len(target.committed), 100)
+        self.assertEqual(target.max_running, 3)
+
+    def test_lanes(self):
+        fast = Target(id='fast', batch_size='10')
+        slow = Target(id='slow', batch_size='25')
+        engine = self._engine([Source(id='source')], [fast, slow],
+                              batch_size=50)
+
+        done = []
+        fast.inject = lambda batch: done.append(('fast', len(batch)))
+        slow.inject = lambda batch: (gevent.sleep(0.05),
+                                     done.append(('slow', len(batch))))
+        engine.run(TODAY, TODAY)
+
+        # the fast target got all its batches before the slow one
+        # was done with its first one
+        self.assertEqual(done[:11], [('fast', 10)] * 10 + [('slow', 25)])
+        self.assertEqual(done[11:], [('slow', 25)] * 3)
+
+    def test_adaptive_batch_size(self):
+        fast = Target(id='fast')
+        slow = SlowTarget(id='slow', max_batch_size='20')
+        engine = self._engine([Source(id='source', count=600)],
+                              [fast, slow], batch_size=10, adaptive=True,
+                              batch_latency=0.05, max_batch_size=200)
+        engine.run(TODAY, TODAY)
+        self.assertEqual(len(fast.committed), 600)
+        self.assertEqual(len(slow.committed), 600)
+
+        # the fast target grew up to the maximum, while the slow one
+        # is capped by its own maximum
+        self.assertEqual(engine.batch_sizes, {'fast': 200, 'slow': 20})
+        self.assertEqual(max(len(batch) for batch in fast.committed_batches),
+                         200)
+
+    def test_shards(self):
+        source, target = Source(id='source', count=1), Target(id='target')
+        failing = FailingSource(id='failing', date=TODAY)
+        start = TODAY - datetime.timedelta(days=6)
+        engine = self._engine([source, failing], [target], retries=1,
+                              shard='day')
+
+        # the failing day does not prevent the others to be committed
+        self.assertEqual(engine.run(start, TODAY), 1)
+        self.assertEqual(len(target.committed), 12)
+        self.assertTrue(self.database.exists(source, start, start))
+        self.assertFalse(self.database.exists(source, TODAY, TODAY))
+
+    def test_concurrent_shards(self):
+        parser = _parser({
+            'phase:extract': {'sources': 'source', 'targets': 'sql'},
+            'source:source': {'use': __name__ + '.Source', 'count': '10'},
+            'target:sql': {'use': 'monolith.aggregator.db.Database',
+                           'database': self.database.sqluri}})
+
+        engine = Engine(Sequence(parser, 'extract'), self.database,
+                        shard='day', shard_concurrency=3)
+        start = TODAY - datetime.timedelta(days=6)
+        self.assertEqual(engine.run(start, TODAY), 0)
+        self.assertEqual(self.database.session.query(Record).count(), 70)
+        self.assertTrue(self.database.exists(Source(id='source:source'),
+                                             start, TODAY))
+
+    def test_checkpoints(self):
+        start = TODAY - datetime.timedelta(days=4)
+        fail_on = TODAY - datetime.timedelta(days=2)
+        source = FlakySource(id='source', count=10)
+        flaky = FlakySource(id='flaky', count=10, date=fail_on)
+        target = Target(id='target')
+        engine = self._engine([source, flaky], [target], checkpoints=True)
+        engine.run(start, TODAY)
+
+        # every day was extracted once, but the failing one
+        days = list(date_range(start, TODAY))
+        self.assertEqual(source.calls, [(day, day) for day in days])
+        self.assertEqual(flaky.calls, [(day, day) for day in days[:3]] +
+                         [(day, day) for day in days[2:]])
+        self.assertEqual(len(target.committed), 100)
+        self.assertEqual(self.database.get_dates(flaky, start, TODAY),
+                         set(days))
+
+        # and nothing is left to do
+        engine.run(start, TODAY)
+        self.assertEqual(len(source.calls), 5)
+
+        # unless we force it
+        engine.force = True
+        engine.run(start, TODAY)
+        self.assertEqual(len(source.calls), 10)
+
+    def test_missing_days(self):
+        start = TODAY - datetime.timedelta(days=9)
+        days = list(date_range(start, TODAY))
+        source, target = FlakySource(id='source', count=1), Target(id='t')
+        self.database.add_entry([source], days[2], days[3])
+        self.database.add_entry([source], days[6])
+
+        engine = self._engine([source], [target])
+        engine.run(start, TODAY)
+        self.assertEqual(source.calls, [(days[0], days[1]),
+                                        (days[4], days[5]),
+                                        (days[7], days[9])])
+        self.assertEqual(self.database.get_dates(source, start, TODAY),
+                         set(days))
+
+        # forcing the run extracts the whole range
+        engine.force = True
+        engine.run(start, TODAY)
+        self.assertEqual(source.calls[-1], (start, TODAY))
+
+    def test_phases_dependencies(self):
+        parser = _parser({
+            'phase:a': {'sources': 's1', 'targets': 't1', 'after': ''},
+            'phase:b': {'sources': 's2', 'targets': 't2', 'after': ''},
+            'phase:c': {'sources': 's3', 'targets': 't1', 'after': 'a, b'},
+            'source:s1': {'use': __name__ + '.Source', 'delay': '0.01',
+                          'count': '5'},
+            'source:s2': {'use': __name__ + '.Source', 'delay': '0.01',
+                          'count': '10'},
+            'source:s3': {'use': __name__ + '.Source', 'count': '1'},
+            'target:t1': {'use': __name__ + '.Target'},
+            'target:t2': {'use': __name__ + '.Target'}})
+        sequence = Sequence(parser, 'c, a, b')
+        t1 = sequence.plugins['target', 't1']
+        t2 = sequence.plugins['target', 't2']
+
+        events = []
+        for target in (t1, t2):
+            target.commit_transaction = partial(
+                lambda target: (events.append(target.get_id()),
+                                Target.commit_transaction(target)), target)
+
+        engine = Engine(sequence, self.database)
+        engine.run(TODAY, TODAY)
+        # a and b ran at the same time, a being shorter, and c waited
+        # for both of them
+        self.assertEqual(events, ['target:t1', 'target:t2', 'target:t1'])
+        self.assertEqual(len(t1.committed), 6)
+        self.assertEqual(len(t2.committed), 10)
+
+    def test_phases_failure(self):
+        sequence = [('extract', [FailingSource(id='failing')],
+                     [Target(id='sql')]),
+                    ('load', [Source(id='sql')], [Target(id='es')])]
+        engine = Engine(sequence, self.database, retries=1)
+        self.assertRaises(RunError, engine.run, TODAY, TODAY)
+        # load is never run if extract failed
+        self.assertEqual(sequence[1][2][0].committed, [])
+
+    def test_stream(self):
+        source = Source(id='source', count=5, delay=0.01)
+        extract, load = Target(id='sql'), Target(id='es')
+        sequence = [('extract', [source], [extract]),
+                    ('load', [Source(id='sql', count=1)], [load])]
+
+        events = []
+        extract_day = source.extract
+
+        def _extract(start_date, end_date):
+            events.append(('extract', start_date))
+            for item in extract_day(start_date, end_date):
+                yield item
+            events.append(('extracted', start_date))
+
+        def _commit():
+            events.append(('loaded', load.batches[0][0][1]['_date']))
+            Target.commit_transaction(load)
+
+        source.extract = _extract
+        load.commit_transaction = _commit
+
+        engine = Engine(sequence, self.database, stream='day')
+        start = TODAY - datetime.timedelta(days=2)
+        engine.run(start, TODAY)
+
+        # the load of a day ran while the next day was extracted
+        days = list(date_range(start, TODAY))
+        for day, next_day in zip(days, days[1:]):
+            self.assertLess(events.index(('extract', next_day)),
+                            events.index(('loaded', day)))
+            self.assertLess(events.index(('loaded', day)),
+                            events.index(('extracted', next_day)))
+        self.assertEqual([line['_date'] for _, line in load.committed],
+                         days)
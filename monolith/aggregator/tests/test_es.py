@@ -117,3 +117,26 @@ class TestESWrite(IsolatedTestCase):
             'anonymous': False,
         })
         self.assertRaises(ValueError, plugin.inject, [data])
+
+    def test_clear_upsert(self):
+        from monolith.aggregator.plugins import es
+        plugin = es.ESWrite(url=self.es_cluster.urls, upsert='true')
+        data = ('sql', {
+            '_id': 'abc123',
+            '_type': 'downloads',
+            'date': datetime.datetime(2012, 7, 4),
+            'source_id': 'zamboni',
+            'count': 1,
+        })
+        plugin.inject([data])
+        self.es_client.refresh()
+
+        # the documents are kept, and a rerun overwrites them
+        day = datetime.date(2012, 7, 4)
+        plugin.clear(day, day, ['zamboni'])
+        data[1]['count'] = 2
+        plugin.inject([data])
+        self.es_client.refresh()
+        res = self.es_client.search({'query': {'match_all': {}}})
+        self.assertEqual(res['hits']['total'], 1)
+        self.assertEqual(res['hits']['hits'][0]['_source']['count'], 2)
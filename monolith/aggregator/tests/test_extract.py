@@ -161,7 +161,9 @@ class TestExtract(IsolatedTestCase):
                 body=fd.read(),
             )
 
-        arguments = ['python', '--date', 'last-month', '--log-level=WARNING']
+        # HTTPretty fakes the sockets, gevent must not replace them
+        arguments = ['python', '--date', 'last-month', '--log-level=WARNING',
+                     '--no-monkey-patch']
 
         def _run(args):
             old = copy.copy(sys.argv)
@@ -0,0 +1,46 @@
+import datetime
+from StringIO import StringIO
+
+from unittest2 import TestCase
+
+from monolith.aggregator.history import report, trends
+
+
+def _run(day, **kinds):
+    run = {'started': datetime.datetime(2013, 1, day), 'status': 'success',
+           'duration': 60.0, 'start_date': datetime.date(2013, 1, day - 1),
+           'end_date': datetime.date(2013, 1, day - 1)}
+    for kind, rates in kinds.items():
+        run[kind] = dict((name, {'records_per_sec': rate, 'time': rate})
+                         for name, rate in rates.items())
+    return run
+
+
+class TestHistory(TestCase):
+
+    def setUp(self):
+        # the most recent first
+        self.runs = [_run(4, sources={'ga': 50.0, 'sql': 100.0}),
+                     _run(3, sources={'ga': 80.0}),
+                     _run(2, sources={'ga': 100.0}, phases={'ga': 10.0})]
+
+    def test_trends(self):
+        self.assertEqual(trends(self.runs),
+                         {'ga': [100.0, 80.0, 50.0],
+                          'sql': [None, None, 100.0]})
+        self.assertEqual(trends(self.runs, 'phases', 'time'),
+                         {'ga': [10.0, None, None]})
+        self.assertEqual(trends([]), {})
+
+    def test_report(self):
+        output = StringIO()
+        report(self.runs, output)
+        lines = output.getvalue().splitlines()
+        self.assertEqual(lines[0], 'Last 3 runs:')
+        self.assertTrue(lines[2].startswith('2013-01-02 00:00:00  success'))
+        ga = [line for line in lines if line.startswith('ga ')]
+        self.assertTrue(ga[1].endswith('100.0       80.0       50.0  -50.0%'))
+
+        output = StringIO()
+        report([], output)
+        self.assertEqual(output.getvalue(), 'No runs.\n')
@@ -0,0 +1,69 @@
+import gevent
+from unittest2 import TestCase
+
+from monolith.aggregator.columns import Columns
+from monolith.aggregator.lane import BatchSizer, Lane
+
+
+class TestBatchSizer(TestCase):
+
+    def test_latency(self):
+        sizer = BatchSizer(100, latency=1.0, smoothing=1)
+        # 10ms per line: 100 lines per second
+        self.assertEqual(sizer.update(100, 1.0), 100)
+        # 1ms per line, growing at most twice at a time
+        self.assertEqual(sizer.update(100, 0.1), 200)
+        self.assertEqual(sizer.update(200, 0.2), 400)
+        self.assertEqual(sizer.update(400, 0.4), 800)
+        self.assertEqual(sizer.update(800, 0.8), 1000)
+        # slower again
+        self.assertEqual(sizer.update(1000, 4.0), 250)
+
+    def test_limits(self):
+        sizer = BatchSizer(100, latency=1.0, min_size=50, max_size=150)
+        self.assertEqual(sizer.update(100, 0.01), 150)
+        self.assertEqual(sizer.update(150, 100.0), 50)
+        # nothing to learn from an empty batch
+        self.assertEqual(sizer.update(0, 0), 50)
+
+    def test_max_bytes(self):
+        sizer = BatchSizer(100, latency=1.0, max_bytes=5000, smoothing=1)
+        # fast, but 100 bytes per line
+        self.assertEqual(sizer.update(100, 0.01, 10000), 50)
+
+    def test_smoothing(self):
+        sizer = BatchSizer(100, latency=1.0, smoothing=0.5)
+        sizer.update(100, 1.0)
+        # a single slow batch only halves the speed estimate
+        self.assertEqual(sizer.update(100, 3.0), 50)
+
+
+class TestLane(TestCase):
+
+    def test_batches(self):
+        batches = []
+        lane = Lane('target', lambda target, batch: batches.append(batch),
+                    batch_size=4)
+        green = gevent.spawn(lane.run)
+        lane.put(('a', [1, 2, 3]))
+        lane.put(('b', [4, 5, 6, 7, 8, 9]))
+        lane.put(('a', [10]))
+        lane.close()
+        green.join()
+        # the lists are cut to make batches of 4 lines
+        self.assertEqual(batches, [[('a', [1, 2, 3]), ('b', [4])],
+                                   [('b', [5, 6, 7, 8])],
+                                   [('b', [9]), ('a', [10])]])
+
+    def test_columns(self):
+        batches = []
+        lane = Lane('target', lambda target, batch: batches.append(batch),
+                    batch_size=2)
+        green = gevent.spawn(lane.run)
+        lane.put(('a', Columns(['value'], [[1, 2, 3]])))
+        lane.close()
+        green.join()
+        self.assertEqual([[(source_id, list(items)) for source_id, items
+                           in batch] for batch in batches],
+                         [[('a', [{'value': 1}, {'value': 2}])],
+                          [('a', [{'value': 3}])]])
@@ -0,0 +1,76 @@
+import datetime
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import urllib2
+
+from unittest2 import TestCase
+
+from monolith.aggregator.bench import servers
+from monolith.aggregator.plugins import Plugin
+from monolith.aggregator.util import json_loads
+
+
+class SocketTarget(Plugin):
+    """Sends a blocking HTTP request per batch."""
+
+    def inject(self, batch):
+        urllib2.urlopen(self.options['url']).read()
+
+
+_CONFIG = """\
+[monolith]
+sequence = load
+database = sqlite:///%(here)s/monolith.db
+report = %(here)s/report.json
+batch_size = 10
+inflight_batches = 4
+
+[phase:load]
+sources = synthetic
+targets = socket
+
+[source:synthetic]
+id = synthetic
+use = monolith.aggregator.plugins.randomizer.SyntheticGenerator
+records = 80
+
+[target:socket]
+id = socket
+use = monolith.aggregator.tests.test_monkey_patch.SocketTarget
+url = {url}
+"""
+
+
+class TestMonkeyPatch(TestCase):
+
+    def setUp(self):
+        self.process, self.url = servers.start(latency=0.2)
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.process.kill()
+        self.process.wait()
+        shutil.rmtree(self.directory)
+
+    def test_blocking_target_overlaps(self):
+        day = datetime.date(2013, 1, 1).isoformat()
+        config = os.path.join(self.directory, 'monolith.ini')
+        with open(config, 'w') as f:
+            f.write(_CONFIG.format(url='%s%s?start=%s&end=%s' % (
+                self.url, servers.TASTYPIE_PATH, day, day)))
+
+        process = subprocess.Popen([
+            sys.executable, '-m', 'monolith.aggregator.extract', config,
+            '--start-date', day, '--end-date', day, '--log-output',
+            os.path.join(self.directory, 'monolith.log')])
+        self.assertEqual(process.wait(), 0)
+
+        stats = json_loads(urllib2.urlopen(self.url + '/_stats').read())
+        self.assertEqual(stats['tastypie']['requests'], 8)
+        # the 8 requests of 0.2s went 4 at a time, instead of 1.6s
+        with open(os.path.join(self.directory, 'report.json')) as f:
+            report = json_loads(f.read())
+        self.assertTrue(report['phases']['load']['time'] < 1.0, report)
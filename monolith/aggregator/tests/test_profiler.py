@@ -0,0 +1,70 @@
+import os
+import pstats
+import shutil
+import signal
+import tempfile
+
+import gevent
+import mock
+from unittest2 import TestCase
+
+from monolith.aggregator.profiler import OTHER, Profiler
+
+
+def _burn(count):
+    return sum(i * i for i in xrange(count))
+
+
+class TestProfiler(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.profiler = Profiler(self.directory)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _phase(self, name, count):
+        self.profiler.register(name)
+        # the greenlets spawned by a phase are accounted to it
+        gevent.joinall([gevent.spawn(_burn, count) for i in range(3)])
+
+    def _functions(self, phase):
+        stats = pstats.Stats(os.path.join(self.directory,
+                                          '%s.pstats' % phase))
+        # the functions of this module, the profiler having a _phase too
+        return dict((func[2], value[0])
+                    for func, value in stats.stats.items()
+                    if func[0].endswith('test_profiler.py'))
+
+    def test_phases(self):
+        self.profiler.start()
+        try:
+            gevent.joinall([gevent.spawn(self._phase, 'one', 100000),
+                            gevent.spawn(self._phase, 'two', 10)])
+        finally:
+            self.profiler.stop()
+        files = self.profiler.write()
+
+        for phase in ('one', 'two'):
+            self.assertTrue(os.path.join(self.directory, '%s.pstats' % phase)
+                            in files)
+            functions = self._functions(phase)
+            self.assertEqual(functions['_burn'], 3)
+            self.assertEqual(functions['_phase'], 1)
+
+        self.assertFalse('_burn' in self._functions(OTHER))
+
+        # the CPU samples of the busy phase
+        with open(os.path.join(self.directory, 'one.collapsed')) as f:
+            lines = f.read().splitlines()
+        self.assertTrue(len(lines) > 0)
+        stack, count = lines[-1].rsplit(' ', 1)
+        self.assertTrue('test_profiler.py:_burn' in stack)
+        self.assertTrue(int(count) > 0)
+
+    def test_restart_system_calls(self):
+        with mock.patch('signal.siginterrupt') as siginterrupt:
+            self.profiler.start()
+            self.profiler.stop()
+        siginterrupt.assert_called_once_with(signal.SIGPROF, False)
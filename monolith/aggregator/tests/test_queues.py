@@ -0,0 +1,91 @@
+import gevent
+from gevent.queue import Full
+from unittest2 import TestCase
+
+from monolith.aggregator.queues import END, SizedQueue, lines, sizeof
+
+
+class TestSizedQueue(TestCase):
+
+    def test_sizeof(self):
+        item = ('source', {'_type': 'foo', 'key': 'value'})
+        self.assertTrue(sizeof(item) > sizeof({}))
+        self.assertTrue(sizeof(item) > sizeof(item[1]))
+
+    def test_max_items(self):
+        queue = SizedQueue(2)
+        queue.put(1)
+        queue.put(2)
+        self.assertRaises(Full, queue.put, 3, False)
+        self.assertEqual(queue.get(), 1)
+        queue.put(3, False)
+
+    def test_max_bytes(self):
+        item = {'key': 'x' * 100}
+        queue = SizedQueue(max_bytes=sizeof(item) * 2)
+        queue.put(item)
+        queue.put(item)
+        self.assertRaises(Full, queue.put, item, False)
+        self.assertRaises(Full, queue.put, item, True, 0.01)
+
+        # a blocked producer resumes once a consumer drained the queue
+        producer = gevent.spawn(queue.put, item)
+        gevent.sleep(0)
+        self.assertFalse(producer.ready())
+        queue.get()
+        producer.join(1)
+        self.assertTrue(producer.successful())
+        self.assertEqual(queue.qsize(), 2)
+
+    def test_oversized_item(self):
+        # an empty queue always accepts an item
+        queue = SizedQueue(max_bytes=1)
+        queue.put({'key': 'value'}, False)
+        self.assertRaises(Full, queue.put, {'key': 'value'}, False)
+
+    def test_clear(self):
+        queue = SizedQueue(max_bytes=10000)
+        queue.put({'key': 'value'})
+        queue.clear()
+        self.assertEqual(queue.qsize(), 0)
+        self.assertEqual(queue.bytes, 0)
+
+    def test_max_lines(self):
+        queue = SizedQueue(3, count=lines)
+        queue.put(('source', [1, 2]), False)
+        queue.put(('source', [3, 4]), False)
+        self.assertEqual(queue.lines, 4)
+        self.assertRaises(Full, queue.put, ('source', [5]), False)
+        queue.get()
+        queue.put(('source', [5]), False)
+        self.assertEqual(queue.lines, 3)
+        queue.get()
+        queue.put(END, False)
+        self.assertEqual(queue.lines, 1)
+        self.assertEqual(queue.peak, 4)
+
+    def test_force(self):
+        queue = SizedQueue(3, count=lines)
+        queue.put(('source', [1, 2, 3]), False)
+        self.assertRaises(Full, queue.put, END, False)
+        queue.put(END, False, force=True)
+        self.assertEqual(queue.qsize(), 2)
+
+    def test_putters_in_turn(self):
+        queue = SizedQueue(2, count=lines)
+        queue.put(('source', [0, 0]))
+        order = []
+
+        def _put(name, count):
+            for i in range(count):
+                queue.put((name, [i]))
+                order.append(name)
+
+        greenlets = [gevent.spawn(_put, 'a', 3), gevent.spawn(_put, 'b', 3)]
+        gevent.sleep(0)
+        while len(order) < 6:
+            queue.get()
+            gevent.sleep(0)
+        gevent.joinall(greenlets)
+        # b does not wait for a to be done
+        self.assertEqual(order[:4], ['a', 'b', 'a', 'b'])
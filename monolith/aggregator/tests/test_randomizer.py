@@ -1,7 +1,17 @@
+from collections import defaultdict
 import datetime
 from unittest2 import TestCase
 
-from monolith.aggregator.plugins.randomizer import RandomGenerator
+from monolith.aggregator.plugins.randomizer import (RandomGenerator,
+                                                    SyntheticGenerator,
+                                                    _ZipfTail)
+
+
+def _count(values):
+    counts = defaultdict(int)
+    for value in values:
+        counts[value] += 1
+    return counts
 
 
 class TestRandomGenerator(TestCase):
@@ -11,5 +21,85 @@ class TestRandomGenerator(TestCase):
         end_date = datetime.datetime(year=2013, month=02, day=28)
 
         gen = RandomGenerator(addons=1)
+        # both dates are included
         self.assertEquals(len(list(gen.extract(start_date, end_date))),
-                          (end_date - start_date).days)
+                          (end_date - start_date).days + 1)
+
+
+class TestSyntheticGenerator(TestCase):
+
+    def setUp(self):
+        self.start = datetime.date(2013, 1, 1)
+        self.end = datetime.date(2013, 1, 3)
+
+    def test_deterministic(self):
+        gen = SyntheticGenerator(seed=42, records=100)
+        lines = list(gen.extract(self.start, self.end))
+        self.assertEqual(len(lines), 300)
+        self.assertEqual(lines, list(SyntheticGenerator(
+            seed=42, records=100).extract(self.start, self.end)))
+
+        # a day is the same whatever the range
+        self.assertEqual(lines[-100:],
+                         list(gen.extract(self.end, self.end)))
+        self.assertNotEqual(lines, list(SyntheticGenerator(
+            seed=1, records=100).extract(self.start, self.end)))
+
+    def test_options(self):
+        gen = SyntheticGenerator(records='1000', types='a:3, b:1',
+                                 dimensions='os:3, app:100000', width='3')
+        lines = list(gen.extract(self.start, self.start))
+        self.assertEqual(sorted(lines[0]),
+                         ['_date', '_type', 'app', 'os', 'value_0',
+                          'value_1', 'value_2'])
+        self.assertEqual(set(line['_date'] for line in lines),
+                         set([self.start]))
+
+        types = _count(line['_type'] for line in lines)
+        self.assertTrue(types['a'] > 2 * types['b'] > 0)
+        self.assertEqual(set(line['os'] for line in lines),
+                         set(['os-0', 'os-1', 'os-2']))
+        self.assertTrue(len(set(line['app'] for line in lines)) > 900)
+
+    def test_skew(self):
+        uniform = SyntheticGenerator(records=10000, dimensions='os:10')
+        skewed = SyntheticGenerator(records=10000, dimensions='os:10',
+                                    skew=2)
+        for gen, low, high in ((uniform, 0.05, 0.15), (skewed, 0.5, 0.8)):
+            counts = _count(line['os'] for line in
+                            gen.extract(self.start, self.start))
+            share = counts['os-0'] / 10000.
+            self.assertTrue(low < share < high, share)
+
+    def test_high_cardinality(self):
+        gen = SyntheticGenerator(records=20000, dimensions='user:10000000',
+                                 skew=1)
+        counts = _count(line['user'] for line in
+                        gen.extract(self.start, self.start))
+        # 1 / H(10 ** 7) of the lines are user-0
+        share = counts['user-0'] / 20000.
+        self.assertTrue(0.04 < share < 0.08, share)
+        # and the values are drawn past pool_size too
+        indexes = [int(user[5:]) for user in counts]
+        self.assertTrue(max(indexes) > gen.pool_size)
+
+    def test_zipf_tail(self):
+        for skew in (0, 0.5, 1., 2.):
+            tail = _ZipfTail(100, 10000, skew)
+            weight = sum(1. / (index + 1) ** skew
+                         for index in range(100, 10000))
+            self.assertAlmostEqual(tail.weight / weight, 1, places=4)
+            self.assertEqual(tail.index(0), 100)
+            self.assertEqual(tail.index(0.99999999), 9999)
+            middle = tail.index(0.5)
+            below = sum(1. / (index + 1) ** skew
+                        for index in range(100, middle))
+            self.assertAlmostEqual(below / weight, 0.5, places=2)
+
+    def test_batches(self):
+        gen = SyntheticGenerator(records=250, batch_size=100)
+        batches = list(gen.extract_batches(self.start, self.end))
+        self.assertEqual([len(batch) for batch in batches],
+                         [100, 100, 50] * 3)
+        self.assertEqual([dict(line) for batch in batches for line in batch],
+                         list(gen.extract(self.start, self.end)))
@@ -0,0 +1,47 @@
+from ConfigParser import ConfigParser
+
+from unittest2 import TestCase
+
+from monolith.aggregator.sequence import Sequence
+
+
+def _config(**phases):
+    parser = ConfigParser()
+    for section in ('source:sql', 'target:sql'):
+        parser.add_section(section)
+        parser.set(section, 'id', 'sql')
+        parser.set(section, 'use', 'monolith.aggregator.plugins.Plugin')
+    for name, after in phases.items():
+        section = 'phase:' + name
+        parser.add_section(section)
+        parser.set(section, 'sources', 'sql')
+        parser.set(section, 'targets', 'sql')
+        if after is not None:
+            parser.set(section, 'after', after)
+    return parser
+
+
+class TestSequence(TestCase):
+
+    def test_linear(self):
+        sequence = Sequence(_config(a=None, b=None, c=None), 'a, b, c')
+        self.assertEqual(sequence.dependencies,
+                         {'a': set(), 'b': set(['a']), 'c': set(['b'])})
+
+    def test_after(self):
+        config = _config(a=None, b='', c='a, b', d='c, other')
+        config.add_section('phase:other')
+        sequence = Sequence(config, 'a, b, c, d')
+        self.assertEqual(sequence.dependencies,
+                         {'a': set(), 'b': set(), 'c': set(['a', 'b']),
+                          'd': set(['c'])})
+
+        # phases out of the sequence are ignored
+        sequence = Sequence(config, 'c')
+        self.assertEqual(sequence.dependencies, {'c': set()})
+
+    def test_errors(self):
+        config = _config(a='b', b='a')
+        self.assertRaises(ValueError, Sequence, config, 'a, b')
+        config = _config(a='undefined')
+        self.assertRaises(ValueError, Sequence, config, 'a')
@@ -0,0 +1,60 @@
+import datetime
+from decimal import Decimal
+import shutil
+import tempfile
+
+from unittest2 import TestCase
+
+from monolith.aggregator.bench import servers
+from monolith.aggregator.bench.sources import _ga, _solitude, _zamboni
+from monolith.aggregator.exception import ServerError
+
+
+class TestServers(TestCase):
+
+    def _start(self, **options):
+        process, url = servers.start(**options)
+        directory = tempfile.mkdtemp()
+
+        def _stop():
+            process.kill()
+            process.wait()
+            shutil.rmtree(directory)
+
+        self.addCleanup(_stop)
+        return url, directory
+
+    def setUp(self):
+        self.day = datetime.date(2013, 1, 1)
+
+    def test_ga(self):
+        reader = _ga(0, *self._start())
+        lines = list(reader.extract(self.day, self.day))
+        # 2500 rows, in pages of 1000, a browser each
+        self.assertEqual(len(lines), 2500)
+        self.assertEqual(len(set(line['browser'] for line in lines)), 2500)
+        self.assertEqual(set(line['_date'] for line in lines),
+                         set([self.day]))
+        self.assertEqual(sum(line['pageviews'] for line in lines),
+                         sum((index * 7 + self.day.toordinal()) % 1000 + 1
+                             for index in range(2500)))
+
+    def test_tastypie(self):
+        reader = _zamboni(0, *self._start())
+        reader.limit = '300'
+        lines = list(reader.extract(self.day, self.day))
+        # 1000 records in 4 pages, grouped by user-agent and app-id
+        self.assertEqual(len(lines), 100)
+        self.assertEqual(sum(line['app_installs'] for line in lines),
+                         sum(index % 7 + 1 for index in range(1000)))
+
+    def test_solitude(self):
+        reader = _solitude(0, *self._start())
+        lines = list(reader.extract(self.day, self.day))
+        self.assertEqual(sum(line['gross_revenue'] for line in lines),
+                         20 * Decimal('0.99'))
+
+    def test_errors(self):
+        reader = _zamboni(0, *self._start(error_rate=1))
+        self.assertRaises(ServerError, list,
+                          reader.extract(self.day, self.day))
@@ -0,0 +1,62 @@
+import os
+import socket
+import tempfile
+
+from unittest2 import TestCase
+
+from monolith.aggregator.stats import Stats
+from monolith.aggregator.util import json_loads
+
+
+class TestStats(TestCase):
+
+    def _stats(self):
+        stats = Stats()
+        stats.start(sequence=['extract'])
+        stats.add('sources', 'source', 'records', 10)
+        stats.add('sources', 'source', 'time', 2.0)
+        stats.add('targets', 'target', 'batches')
+        stats.add('targets', 'target', 'batches')
+        stats.peak('queues', 'phase:extract', 'peak', 5)
+        stats.peak('queues', 'phase:extract', 'peak', 3)
+        with stats.timer('phases', 'extract'):
+            pass
+        stats.stop('success')
+        return stats
+
+    def test_report(self):
+        report = json_loads(self._stats().to_json())
+        self.assertEqual(report['status'], 'success')
+        self.assertEqual(report['sequence'], ['extract'])
+        self.assertEqual(report['sources']['source'],
+                         {'records': 10, 'time': 2.0, 'records_per_sec': 5.0})
+        self.assertEqual(report['targets']['target'], {'batches': 2})
+        self.assertEqual(report['queues']['phase:extract'], {'peak': 5})
+        self.assertTrue(report['phases']['extract']['time'] >= 0)
+        self.assertTrue(report['duration'] >= 0)
+
+    def test_prometheus(self):
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            self._stats().write_prometheus(path)
+            with open(path) as f:
+                lines = f.read().splitlines()
+        finally:
+            os.remove(path)
+
+        self.assertTrue('monolith_source_records{name="source"} 10' in lines)
+        self.assertTrue('monolith_target_batches{name="target"} 2' in lines)
+        self.assertTrue('monolith_run_success 1' in lines)
+
+    def test_statsd(self):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        sock.settimeout(1)
+        try:
+            self._stats().send_statsd('127.0.0.1', sock.getsockname()[1])
+            packets = [sock.recv(1024) for i in range(7)]
+        finally:
+            sock.close()
+        self.assertTrue('monolith.sources.source.records:10|g' in packets)
+        self.assertTrue('monolith.queues.phase_extract.peak:5|g' in packets)
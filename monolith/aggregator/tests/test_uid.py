@@ -0,0 +1,67 @@
+from base64 import urlsafe_b64decode
+from datetime import date, datetime
+
+from unittest2 import TestCase
+
+from monolith.aggregator import uid
+from monolith.aggregator.uid import natural_uid, urlsafe_uid, urlsafe_uids
+
+
+def _value(id_):
+    return int(urlsafe_b64decode(id_).encode('hex'), 16)
+
+
+class TestUid(TestCase):
+
+    def test_urlsafe_uid(self):
+        day = date(2013, 1, 1)
+        id_ = urlsafe_uid(day)
+        self.assertEqual(len(id_), 24)
+        self.assertNotEqual(id_, urlsafe_uid(day))
+
+    def test_natural_uid(self):
+        day = datetime(2013, 1, 1)
+        id_ = natural_uid('s1', day, 'installs', {'app': 1})
+        self.assertEqual(len(id_), 24)
+        self.assertEqual(id_, natural_uid('s1', day.date(), 'installs',
+                                          {'app': 1}))
+        for other in (natural_uid('s2', day, 'installs', {'app': 1}),
+                      natural_uid('s1', day, 'visits', {'app': 1}),
+                      natural_uid('s1', day, 'installs', {'app': 2}),
+                      natural_uid('s1', date(2013, 1, 2), 'installs',
+                                  {'app': 1})):
+            self.assertNotEqual(id_, other)
+
+    def test_natural_uid_prefix(self):
+        # the ids of a day share a prefix, following the dates
+        ids = [natural_uid('s1', date(2013, 1, day), 'installs',
+                           {'app': app})
+               for day in (1, 2) for app in range(10)]
+        self.assertEqual(len(set(ids)), 20)
+        self.assertEqual(set(id_[:4] for id_ in ids[:10]), set([ids[0][:4]]))
+        self.assertEqual(set(id_[:4] for id_ in ids[10:]),
+                         set([ids[10][:4]]))
+        self.assertNotEqual(ids[0][:4], ids[10][:4])
+
+    def test_urlsafe_uids(self):
+        day = date(2013, 1, 1)
+        ids = urlsafe_uids(100, day)
+        self.assertEqual(len(ids), 100)
+        self.assertEqual(len(set(ids)), 100)
+        self.assertTrue(all(len(id_) == 24 for id_ in ids))
+        # the bytes of the ids follow each other
+        values = [_value(id_) for id_ in ids]
+        self.assertEqual(values, range(values[0], values[0] + 100))
+        self.assertEqual(urlsafe_uids(0, day), [])
+
+    def test_urlsafe_uids_carry(self):
+        # the ids keep following each other when the low 64 bits wrap
+        old_start = uid._start
+        uid._start = lambda _date: (5 << 64) + (1 << 64) - 2
+        try:
+            ids = urlsafe_uids(4, date(2013, 1, 1))
+        finally:
+            uid._start = old_start
+        values = [_value(id_) for id_ in ids]
+        self.assertEqual(values, range(values[0], values[0] + 4))
+        self.assertEqual(values[0] & ((1 << 80) - 1), (6 << 64) - 2)
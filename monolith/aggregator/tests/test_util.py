@@ -1,7 +1,8 @@
 from unittest2 import TestCase
 from datetime import date, datetime, timedelta
 
-from monolith.aggregator.util import word2daterange, date_range
+from monolith.aggregator.util import word2daterange, date_range, date_shards
+from monolith.aggregator.util import contiguous_ranges
 from monolith.aggregator.util import json_loads, json_dumps
 
 
@@ -45,6 +46,37 @@ class TestUtils(TestCase):
         self.assertEqual(list(date_range(yesterday, now)), [yesterday, now])
         self.assertEqual(list(date_range(yesterday, yesterday)), [yesterday])
 
+    def test_contiguous_ranges(self):
+        days = [date(2013, 1, day) for day in (9, 1, 2, 3, 5, 31, 30)]
+        self.assertEqual(contiguous_ranges(days),
+                         [(date(2013, 1, 1), date(2013, 1, 3)),
+                          (date(2013, 1, 5), date(2013, 1, 5)),
+                          (date(2013, 1, 9), date(2013, 1, 9)),
+                          (date(2013, 1, 30), date(2013, 1, 31))])
+        self.assertEqual(contiguous_ranges([]), [])
+
+    def test_date_shards(self):
+        start, end = date(2013, 1, 30), date(2013, 3, 5)
+
+        days = date_shards(start, end, 'day')
+        self.assertEqual(len(days), 35)
+        self.assertEqual(days[0], (start, start))
+
+        # 2013-01-30 is a wednesday
+        weeks = date_shards(start, end, 'week')
+        self.assertEqual(weeks[0], (start, date(2013, 2, 3)))
+        self.assertEqual(weeks[1], (date(2013, 2, 4), date(2013, 2, 10)))
+        self.assertEqual(weeks[-1], (date(2013, 3, 4), end))
+
+        months = date_shards(start, end, 'month')
+        self.assertEqual(months, [(start, date(2013, 1, 31)),
+                                  (date(2013, 2, 1), date(2013, 2, 28)),
+                                  (date(2013, 3, 1), end)])
+
+        self.assertEqual(date_shards(end, start, 'day'), [])
+        self.assertRaises(NotImplementedError, date_shards, start, end,
+                          'year')
+
 
 class TestJSON(TestCase):
 
@@ -1,21 +1,24 @@
 from base64 import urlsafe_b64encode
 from calendar import timegm
 from datetime import date, datetime
+import hashlib
 import random
+import struct
 import uuid
 
+from monolith.aggregator.util import json_dumps
+
 
 _randrange = random.Random().randrange
 _node = uuid.getnode()
+# the node, then the 80 bits of time and clock sequence
+_node_bytes = struct.pack('>Q', _node)[2:]
+_pack = struct.Struct('>6sHQ').pack
+_pack_low = struct.Struct('>I').pack
+_low_mask = (1L << 64L) - 1
 
 
-def urlsafe_uid(_date=None):
-    """
-    A simplified version of uuid1 - optimized for usage as a
-    MySQL primary key and ElasticSearch id.
-    """
-    if _date is None:
-        _date = date.today()
+def _start(_date):
     # take the passed in date, and add the current time to it
     # that way we preserve the right coarse-grained date, but also
     # make duplicates less likely by having a non-constant time part
@@ -31,11 +34,53 @@ def urlsafe_uid(_date=None):
 
     # order so we get a stable prefix per node and time, which helps
     # data locality in BTree inserts
-    int_ = ((_node << 80L) | (time_hi << 64L) | (time_mid << 48L) |
-            (time_low << 16L) | clock_seq)
+    return ((time_hi << 64L) | (time_mid << 48L) | (time_low << 16L) |
+            clock_seq)
 
-    bytes = ''
-    for shift in range(0, 128, 8):
-        bytes = chr((int_ >> shift) & 0xff) + bytes
 
-    return urlsafe_b64encode(bytes)
+def urlsafe_uid(_date=None):
+    """
+    A simplified version of uuid1 - optimized for usage as a
+    MySQL primary key and ElasticSearch id.
+    """
+    return urlsafe_uids(1, _date)[0]
+
+
+def urlsafe_uids(count, _date=None):
+    """
+    Returns *count* ids like :func:`urlsafe_uid` for the same date.
+
+    The time and clock sequence are only taken once, and the ids follow
+    each other from there, so they are sorted and go to the same place
+    of the index when inserted in that order.
+    """
+    if _date is None:
+        _date = date.today()
+    start = _start(_date)
+    # most of the time only the low 32 bits change, and xrange can count
+    # them, whereas Python 2.6 cannot count past sys.maxint
+    low = start & 0xffffffffL
+    if low + count <= 0xffffffffL:
+        prefix = _node_bytes + struct.pack('>Q', start >> 32L)[2:]
+        return [urlsafe_b64encode(prefix + _pack_low(value))
+                for value in xrange(low, low + count)]
+    values = (start + index for index in xrange(count))
+    return [urlsafe_b64encode(_pack(_node_bytes, value >> 64L,
+                                    value & _low_mask))
+            for value in values]
+
+
+def natural_uid(source_id, _date, type, dimensions):
+    """
+    A deterministic id, derived from the natural key of a record.
+
+    The first three bytes are the ordinal of the date, so the ids of a
+    day share their first four characters and stay close to each other
+    in BTree inserts. The other thirteen bytes are a hash of the source,
+    the type and the *dimensions* mapping.
+    """
+    if isinstance(_date, datetime):
+        _date = _date.date()
+    key = json_dumps([source_id, _date, type, sorted(dimensions.items())])
+    prefix = struct.pack('>I', _date.toordinal())[1:]
+    return urlsafe_b64encode(prefix + hashlib.sha1(key).digest()[:13])
@@ -1,4 +1,5 @@
 from calendar import monthrange
+from collections import Mapping
 from datetime import date, datetime, timedelta
 import fcntl
 import logging
@@ -15,9 +16,19 @@ def encode_date(obj):
         return obj.strftime('%Y-%m-%dT%H:%M:%S.%f')
     elif isinstance(obj, date):
         return obj.strftime('%Y-%m-%d')
+    elif isinstance(obj, Mapping):
+        # the row views of columnar batches
+        return dict(obj)
     raise TypeError(repr(obj) + " is not JSON serializable")
 
 
+def boolean(value):
+    """Reads a boolean option, which may be a string of the config."""
+    if isinstance(value, bool):
+        return value
+    return value.lower() in ('1', 'yes', 'true', 'on')
+
+
 def json_loads(obj):
     return json.loads(obj)
 
@@ -105,3 +116,41 @@ def date_range(start, end):
     """
     delta = (end - start).days + 1
     return (start + timedelta(n) for n in range(delta))
+
+
+def contiguous_ranges(dates):
+    """Groups dates in ranges of consecutive days.
+
+    Returns a list of (start, end) tuples, both dates included.
+    """
+    ranges = []
+    for current in sorted(dates):
+        if ranges and current - ranges[-1][1] == timedelta(days=1):
+            ranges[-1] = ranges[-1][0], current
+        else:
+            ranges.append((current, current))
+    return ranges
+
+
+def date_shards(start, end, size):
+    """Splits a range of dates in shards.
+
+    *size* is one of "day", "week" or "month". Shards follow the
+    calendar - weeks start on mondays - and are clipped to the range.
+    Returns a list of (start, end) tuples, both dates included.
+    """
+    shards = []
+    while start <= end:
+        if size == 'day':
+            last = start
+        elif size == 'week':
+            last = start + timedelta(days=6 - start.weekday())
+        elif size == 'month':
+            last = start.replace(day=monthrange(start.year, start.month)[1])
+        else:
+            raise NotImplementedError(size)
+
+        last = min(last, end)
+        shards.append((start, last))
+        start = last + timedelta(days=1)
+    return shards
@@ -68,5 +68,6 @@ setup(name='monolith.aggregator',
       entry_points="""
       [console_scripts]
       monolith-extract = monolith.aggregator.extract:main
+      monolith-history = monolith.aggregator.history:main
       monolith-ga-oauth = tools.auth_google_analytics:main
       """)